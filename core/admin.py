@@ -6,7 +6,8 @@ from django.urls import reverse
 from django.utils.http import urlencode
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.admin import UserAdmin, GroupAdmin
-from .models import Service, Order, UserProfile, CartItem, PricingConfig, Location, PublicHoliday, Coupon, PopupOffer
+from .models import Service, Order, UserProfile, CartItem, PricingConfig, Location, PublicHoliday, Coupon, PopupOffer, StoredDocument
+from .thumbnails import thumbnail_url
 
 # --- 🛠️ 1. CUSTOM ADMIN SITE SETUP ---
 class FastCopyAdminSite(admin.AdminSite):
@@ -108,18 +109,20 @@ class OrderAdmin(admin.ModelAdmin):
     
     list_filter = ('status', 'payment_status', ServiceTypeFilter, 'location', ('created_at', admin.DateFieldListFilter))
     search_fields = ('order_id', 'transaction_id', 'user__first_name', 'user__username')
+    list_select_related = ('stored_document',)
     
     readonly_fields = (
         'order_id', 'created_at', 'user_name', 'user_email', 
         'mobile_number', 'document', 'image_upload', 
-        'display_full_file_preview', 'printing_type_display'
+        'display_full_file_preview', 'printing_type_display',
+        'dealer_amount', 'color_page_count', 'effective_sheets', 'stored_document'
     )
     
     fieldsets = (
         ('User Information', {'fields': ('user', 'location', 'user_name', 'mobile_number', 'user_email')}),
-        ('Printing Specs', {'fields': ('service_name', 'print_mode', 'side_type', 'copies', 'custom_color_pages')}),
-        ('File Management', {'fields': ('document', 'image_upload', 'display_full_file_preview')}),
-        ('Financials', {'fields': ('original_price', 'coupon_code', 'discount_amount', 'total_price', 'transaction_id', 'payment_status')}),
+        ('Printing Specs', {'fields': ('service_name', 'print_mode', 'side_type', 'copies', 'custom_color_pages', 'color_page_count', 'effective_sheets')}),
+        ('File Management', {'fields': ('document', 'image_upload', 'stored_document', 'display_full_file_preview')}),
+        ('Financials', {'fields': ('original_price', 'coupon_code', 'discount_amount', 'total_price', 'dealer_amount', 'transaction_id', 'payment_status')}),
         ('Workflow Metadata', {'fields': ('status', 'order_id', 'created_at')}),
     )
 
@@ -127,9 +130,14 @@ class OrderAdmin(admin.ModelAdmin):
         url = reverse('fastcopy_admin:core_order_change', args=[obj.id])
         return format_html('<a href="{}" style="font-weight:bold;color:#2563eb">{}</a>', url, obj.order_id or f"ORD-{obj.id}")
 
+    def _file_digest(self, obj):
+        # The blob's SHA-256 is already known, so previews never hash the file in this request
+        return obj.stored_document.sha256 if obj.stored_document_id else None
+
     def display_file_thumbnail(self, obj):
         if obj.image_upload:
-            return format_html('<a href="{}" target="_blank"><img src="{}" style="width:35px;height:35px;object-fit:cover;border-radius:4px;"/></a>', obj.image_upload.url, obj.image_upload.url)
+            # Small WebP preview instead of the original photo
+            return format_html('<a href="{}" target="_blank"><img src="{}" loading="lazy" style="width:35px;height:35px;object-fit:cover;border-radius:4px;"/></a>', obj.image_upload.url, thumbnail_url(obj.image_upload.name, 's', self._file_digest(obj)))
         elif obj.document:
             return format_html('<a href="{}" target="_blank" style="background:#2563eb;color:#fff;padding:2px 8px;border-radius:4px;font-size:10px;text-decoration:none">📂 PDF</a>', obj.document.url)
         return mark_safe('<span style="color:var(--body-quiet-color)">No File</span>')
@@ -137,8 +145,10 @@ class OrderAdmin(admin.ModelAdmin):
     def display_full_file_preview(self, obj):
         html = ""
         if obj.image_upload:
-            html += format_html('<div style="margin-bottom:10px;"><img src="{}" style="max-width:300px;border-radius:8px;border:1px solid var(--border-color);"/></div>', obj.image_upload.url)
+            html += format_html('<div style="margin-bottom:10px;"><a href="{}" target="_blank"><img src="{}" style="max-width:300px;border-radius:8px;border:1px solid var(--border-color);"/></a></div>', obj.image_upload.url, thumbnail_url(obj.image_upload.name, 'm', self._file_digest(obj)))
         if obj.document:
+            # First page of the PDF as a preview
+            html += format_html('<div style="margin-bottom:10px;"><img src="{}" style="max-width:300px;border-radius:8px;border:1px solid var(--border-color);"/></div>', thumbnail_url(obj.document.name, 'm', self._file_digest(obj)))
             html += format_html('<a href="{}" target="_blank" style="background:#1e293b;color:#fff;padding:8px 15px;border-radius:5px;text-decoration:none;display:inline-block;">👁️ View Full Document</a>', obj.document.url)
         return mark_safe(html) if html else "No file uploaded"
 
@@ -370,7 +380,7 @@ class PopupOfferAdmin(admin.ModelAdmin):
     
     def thumbnail(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="width: 50px; height: 30px; object-fit: cover; border-radius: 4px;" />', obj.image.url)
+            return format_html('<img src="{}" loading="lazy" style="width: 50px; height: 30px; object-fit: cover; border-radius: 4px;" />', thumbnail_url(obj.image.name))
         return ""
     
     def status_badge(self, obj):
@@ -385,3 +395,13 @@ class PopupOfferAdmin(admin.ModelAdmin):
             return format_html('<span style="color: #be123c;">Expired</span>')
         else:
             return format_html('<span style="color: #15803d; font-weight: bold;">Matches Criteria</span>')
+
+
+# --- 📦 10. STORED DOCUMENT ADMIN ---
+@admin.register(StoredDocument, site=admin_site)
+class StoredDocumentAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'kind', 'size', 'pages', 'ref_count', 'created_at')
+    list_filter = ('kind',)
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'file', 'kind', 'size', 'pages', 'ref_count', 'created_at')
+    def has_add_permission(self, request): return False
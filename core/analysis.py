@@ -0,0 +1,408 @@
+"""
+PDF analysis service for FastCopy.
+
+Parsing user PDFs is CPU and memory hungry and a malformed file can hang the
+parser, so it never runs in the request thread. Jobs go to a small
+ProcessPoolExecutor whose workers:
+- cap their address space with RLIMIT_AS,
+- abort any single job after a wall-clock timeout (SIGALRM in the worker),
+- are recycled after a fixed number of jobs.
+The view only waits on a future. At most PDF_ANALYSIS_WORKERS jobs per web
+process are in the pool at once, so a job starts as soon as it is submitted;
+requests beyond that wait up to PDF_ANALYSIS_QUEUE_WAIT for a slot and are
+then told the service is busy. If a worker is stuck inside C code and the wait
+times out anyway, its pool is retired: new jobs go to a fresh pool, and the old
+one is killed once its other jobs have finished.
+
+Jobs: page counting, colour-page detection (low-DPI renders compared
+channel by channel) used to prefill the custom split colour pages, and
+WebP thumbnail rendering for core/thumbnails.py.
+
+Worker code must not touch Django models: workers are spawned processes that
+only receive a filesystem path.
+"""
+import io
+import mmap
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .uploads import PDF
+from .utils import format_page_ranges
+
+# Colour detection: pages are rendered this small, and a page counts as colour
+# when enough pixels have channels that differ by more than the delta (0-255).
+# Grey text, anti-aliasing and scanner noise stay well under it.
+COLOR_SCAN_DPI = 30
+COLOR_CHANNEL_DELTA = 48
+COLOR_MIN_FRACTION = 0.0002  # of the page's pixels
+# The scan only prefills a form field, so it is best effort: skipped for long
+# documents or when no worker is free, and cut short by its own small timeout.
+COLOR_SCAN_MAX_PAGES = 100
+COLOR_SCAN_TIMEOUT = 3  # seconds per chunk
+
+# Beyond a job's own timeout: time to spawn a worker, or for a parser stuck in C code to be noticed
+RESULT_SLACK = 2  # seconds
+
+_lock = threading.Lock()
+_pool = {'executor': None, 'slots': None}
+_inflight = {}  # executor -> its unfinished futures
+
+
+class AnalysisError(Exception):
+    """Analysis failed or timed out; the message is safe to show to the user."""
+
+
+class _JobTimeout(Exception):
+    pass
+
+
+# --- 🧵 1. WORKER SIDE ---
+
+def _init_worker(memory_limit):
+    """Runs once in every worker process."""
+    # Ctrl+C / gunicorn reloads are handled by the parent
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit:
+        try:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ImportError, ValueError, OSError):
+            pass  # not supported on this platform
+
+
+def _on_alarm(signum, frame):
+    raise _JobTimeout()
+
+
+def _run_job(func, args, timeout):
+    """Runs func(*args) with a wall-clock alarm; returns ('ok', result) or ('error', message)."""
+    signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return 'ok', func(*args)
+    except _JobTimeout:
+        return 'error', 'Timed out while reading the document'
+    except MemoryError:
+        return 'error', 'Document is too complex to process'
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+@contextmanager
+def _pdf_source(source):
+    """
+    Cheapest way to hand a PDF to the parsers, without copying it into a new bytes object.
+    Yields (filename, buffer) with exactly one of them set:
+    - paths and disk-spooled uploads (TemporaryUploadedFile) are opened by name,
+    - in-memory uploads (InMemoryUploadedFile / BytesIO) lend their existing buffer.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        yield os.fspath(source), None
+    elif hasattr(source, 'temporary_file_path'):
+        yield source.temporary_file_path(), None
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield None, source
+    else:
+        with getattr(source, 'file', source).getbuffer() as buffer:
+            yield None, buffer
+
+
+def count_pdf_pages(source):
+    """
+    Page counter (run inside a worker for uploads). Returns (pages, error).
+    `source` is a path, an UploadedFile or a bytes-like buffer; see _pdf_source.
+    1. Tries PyMuPDF (fitz) - opens files by name, so pages are read lazily from disk.
+    2. Falls back to PyPDF2 over an mmap of the same file - no second read into RAM.
+    """
+    with _pdf_source(source) as (filename, buffer):
+        # METHOD 1: PyMuPDF (Fastest)
+        try:
+            import fitz  # PyMuPDF
+            if filename:
+                doc = fitz.open(filename, filetype="pdf")
+            else:
+                doc = fitz.open(stream=buffer, filetype="pdf")
+            page_count = doc.page_count
+            doc.close()
+            return page_count, None
+        except ImportError:
+            # PyMuPDF not installed, falling back...
+            pass
+        except (_JobTimeout, MemoryError):
+            raise
+        except Exception as e:
+            print(f"PyMuPDF Error: {e}")
+
+        # METHOD 2: PyPDF2 (Optimized Fallback)
+        try:
+            import PyPDF2
+            if filename:
+                with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    pdf_reader = PyPDF2.PdfReader(mapped)
+                    encrypted, page_count = pdf_reader.is_encrypted, len(pdf_reader.pages)
+            else:
+                pdf_reader = PyPDF2.PdfReader(io.BytesIO(buffer))
+                encrypted, page_count = pdf_reader.is_encrypted, len(pdf_reader.pages)
+            if encrypted:
+                return None, 'File is encrypted'
+            return page_count, None
+        except (_JobTimeout, MemoryError):
+            raise
+        except Exception as e:
+            print(f"PyPDF2 Error: {e}")
+            return None, 'Invalid PDF file'
+
+
+def _is_color_pixmap(pixmap):
+    """Channel-difference test on an RGB pixmap; all per-pixel work happens inside Pillow."""
+    from PIL import Image, ImageChops
+
+    image = Image.frombuffer('RGB', (pixmap.width, pixmap.height), pixmap.samples_mv, 'raw', 'RGB', pixmap.stride, 1)
+    red, green, blue = image.split()
+    spread = ImageChops.lighter(
+        ImageChops.lighter(ImageChops.difference(red, green), ImageChops.difference(green, blue)),
+        ImageChops.difference(red, blue),
+    )
+    coloured = sum(spread.histogram()[COLOR_CHANNEL_DELTA:])
+    return coloured > pixmap.width * pixmap.height * COLOR_MIN_FRACTION
+
+
+def color_pages_in_range(path, start, stop):
+    """Worker job: 1-based numbers of the colour pages among pages start..stop-1 (0-based)."""
+    import fitz  # PyMuPDF
+
+    found = []
+    with fitz.open(path, filetype="pdf") as doc:
+        for index in range(start, min(stop, doc.page_count)):
+            pixmap = doc[index].get_pixmap(dpi=COLOR_SCAN_DPI, colorspace=fitz.csRGB, alpha=False, annots=False)
+            if _is_color_pixmap(pixmap):
+                found.append(index + 1)
+    return found
+
+
+def render_thumbnail(source, dest, kind, max_px, quality):
+    """
+    Worker job: writes a WebP preview (longest edge max_px) of an image, or of
+    a PDF's first page, to dest. The file appears atomically.
+    """
+    from PIL import Image, ImageOps
+
+    if kind == PDF:
+        import fitz  # PyMuPDF
+        with fitz.open(source, filetype="pdf") as doc:
+            page = doc[0]
+            zoom = max_px / max(page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=False, annots=False)
+            image = Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+    else:
+        with Image.open(source) as original:
+            original.draft('RGB', (max_px, max_px))  # JPEG decodes at a reduced scale
+            image = ImageOps.exif_transpose(original)
+            image.thumbnail((max_px, max_px))
+            image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    partial = f"{dest}.{os.getpid()}.part"
+    image.save(partial, 'WEBP', quality=quality, method=4)
+    os.replace(partial, dest)
+    return dest
+
+
+# --- 🏭 2. POOL SIDE ---
+
+def _executor():
+    executor = _pool['executor']
+    if executor is None:
+        with _lock:
+            executor = _pool['executor']
+            if executor is None:
+                executor = ProcessPoolExecutor(
+                    max_workers=settings.PDF_ANALYSIS_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(settings.PDF_ANALYSIS_MEMORY_LIMIT,),
+                    max_tasks_per_child=settings.PDF_ANALYSIS_MAX_TASKS_PER_WORKER,
+                )
+                _pool['executor'] = executor
+    return executor
+
+
+def _slots():
+    slots = _pool['slots']
+    if slots is None:
+        with _lock:
+            if _pool['slots'] is None:
+                _pool['slots'] = threading.BoundedSemaphore(settings.PDF_ANALYSIS_WORKERS)
+            slots = _pool['slots']
+    return slots
+
+
+def _finished(executor, slots, future):
+    slots.release()
+    with _lock:
+        _inflight.get(executor, set()).discard(future)
+
+
+def _submit(func, args, timeout, queue_wait):
+    """Takes a worker slot (waiting up to queue_wait seconds) and submits one job; returns (executor, future)."""
+    slots = _slots()
+    if not slots.acquire(timeout=queue_wait):
+        raise AnalysisError('The document service is busy, please try again in a moment')
+    try:
+        executor = _executor()
+        try:
+            future = executor.submit(_run_job, func, args, timeout)
+        except BrokenProcessPool:
+            raise
+        except RuntimeError:  # shut down by another request since we looked it up
+            executor = _executor()
+            future = executor.submit(_run_job, func, args, timeout)
+    except BrokenProcessPool:
+        slots.release()
+        _discard(executor)
+        raise AnalysisError('Document is too complex to process')
+    except BaseException:
+        slots.release()
+        raise
+    with _lock:
+        _inflight.setdefault(executor, set()).add(future)
+    future.add_done_callback(partial(_finished, executor, slots))
+    return executor, future
+
+
+def _discard(executor):
+    """Kills a pool (wedged or already broken) so the next job gets a fresh one."""
+    with _lock:
+        if _pool['executor'] is executor:
+            _pool['executor'] = None
+        _inflight.pop(executor, None)
+    for process in list((getattr(executor, '_processes', None) or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _retire(executor, stuck):
+    """
+    Stops routing jobs to a pool with a wedged worker. Its other jobs belong to
+    other requests and are bounded by their own alarms, so they are left to
+    finish before the pool's processes are killed.
+    """
+    with _lock:
+        if _pool['executor'] is executor:
+            _pool['executor'] = None
+        others = [future for future in _inflight.get(executor, ()) if future is not stuck]
+    grace = settings.PDF_ANALYSIS_TIMEOUT + RESULT_SLACK
+
+    def reap():
+        wait(others, timeout=grace)
+        _discard(executor)
+
+    threading.Thread(target=reap, name='pdf-analysis-reaper', daemon=True).start()
+
+
+def run_many(func, arg_list, timeout=None, queue_wait=None):
+    """
+    Runs func(*args) for every tuple in arg_list across the pool and returns the
+    results in order. The timeout applies to each job from when it starts;
+    queue_wait (default PDF_ANALYSIS_QUEUE_WAIT) bounds the wait for a free
+    worker. Any failure raises AnalysisError.
+    """
+    timeout = timeout or settings.PDF_ANALYSIS_TIMEOUT
+    queue_wait = settings.PDF_ANALYSIS_QUEUE_WAIT if queue_wait is None else queue_wait
+    jobs = []
+    try:
+        for args in arg_list:
+            # A job holds its slot from submission, so it starts right away
+            jobs.append((*_submit(func, args, timeout, queue_wait), time.monotonic() + timeout + RESULT_SLACK))
+        outcomes = []
+        for executor, future, deadline in jobs:
+            try:
+                outcomes.append(future.result(timeout=max(0, deadline - time.monotonic())))
+            except FutureTimeoutError:
+                _retire(executor, future)
+                raise AnalysisError('Timed out while reading the document')
+            except BrokenProcessPool:
+                _discard(executor)
+                raise AnalysisError('Document is too complex to process')
+    except AnalysisError:
+        for _, future, _ in jobs:
+            future.cancel()
+        raise
+    for status, value in outcomes:
+        if status == 'error':
+            raise AnalysisError(value)
+    return [value for _, value in outcomes]
+
+
+def run(func, *args, timeout=None):
+    """
+    Runs a module-level function in the analysis pool and returns its result.
+    Raises AnalysisError on timeout, memory exhaustion or a crashed worker.
+    """
+    return run_many(func, [args], timeout=timeout)[0]
+
+
+def find_color_pages(path, page_count):
+    """
+    Detects the colour pages of a PDF, scanning page chunks in parallel (one per worker).
+    Returns (canonical range string, colour page count), e.g. ("1,4-6", 4).
+    Raises AnalysisError when the document is too long, the pool is busy or the
+    scan overruns COLOR_SCAN_TIMEOUT; callers just skip the prefill then.
+    """
+    if not page_count:
+        return '', 0
+    if page_count > COLOR_SCAN_MAX_PAGES:
+        raise AnalysisError('Too many pages to scan for colour')
+    chunk = -(-page_count // settings.PDF_ANALYSIS_WORKERS)
+    chunks = run_many(
+        color_pages_in_range, [(path, start, start + chunk) for start in range(0, page_count, chunk)],
+        timeout=COLOR_SCAN_TIMEOUT, queue_wait=0,
+    )
+    pages = [page for found in chunks for page in found]
+
+    intervals = []
+    for page in pages:
+        if intervals and page == intervals[-1][1] + 1:
+            intervals[-1] = (intervals[-1][0], page)
+        else:
+            intervals.append((page, page))
+    return format_page_ranges(intervals), len(pages)
+
+
+@contextmanager
+def local_path(name):
+    """
+    Filesystem path for a stored file that worker processes can open.
+    Local storage hands out its own path; other backends are spooled to a temp file.
+    """
+    try:
+        path = default_storage.path(name)
+    except NotImplementedError:
+        path = None
+    if path:
+        yield path
+        return
+    with tempfile.NamedTemporaryFile() as tmp, default_storage.open(name, 'rb') as source:
+        shutil.copyfileobj(source, tmp)
+        tmp.flush()
+        yield tmp.name
+
+
+def shutdown():
+    """Stops the pool (tests / process exit)."""
+    executor = _pool['executor']
+    if executor is not None:
+        _discard(executor)
@@ -0,0 +1,45 @@
+"""
+Per-user cart item counter for the navbar badge.
+
+The count lives in the user's session and is adjusted in place by the views
+that add or remove CartItem rows, so rendering a page costs no COUNT(*). The
+session is shared by every worker, unlike a per-process cache. The database is
+counted again when the session has no count, or when the count is older than
+CART_COUNT_TTL, which bounds drift from changes made in another session
+(a second device, the admin).
+"""
+import time
+
+from .models import CartItem
+
+CART_COUNT_SESSION_KEY = 'cart_count'
+CART_COUNT_TTL = 5 * 60  # seconds
+
+
+def get_cart_count(request):
+    """Cart size for the logged-in user, counting rows only when the session has no fresh count."""
+    entry = request.session.get(CART_COUNT_SESSION_KEY)
+    now = time.time()
+    if entry and now - entry[1] < CART_COUNT_TTL:
+        return entry[0]
+    count = CartItem.objects.filter(user=request.user).count()
+    request.session[CART_COUNT_SESSION_KEY] = [count, now]
+    return count
+
+
+def adjust_cart_count(request, delta):
+    """Applies +/- delta to the session count; a missing count is simply recounted later."""
+    entry = request.session.get(CART_COUNT_SESSION_KEY)
+    if not delta or not entry:
+        return
+    request.session[CART_COUNT_SESSION_KEY] = [max(entry[0] + delta, 0), entry[1]]
+
+
+def set_cart_count(request, count):
+    """Stores a known count, e.g. 0 after the cart has been emptied."""
+    request.session[CART_COUNT_SESSION_KEY] = [count, time.time()]
+
+
+def forget_cart_count(request):
+    """Drops the count so the next render recounts (cart changed somewhere we cannot track precisely)."""
+    request.session.pop(CART_COUNT_SESSION_KEY, None)
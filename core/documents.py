@@ -0,0 +1,112 @@
+"""
+Content-addressed, reference-counted document store for FastCopy.
+
+Every distinct document is kept once under documents/YYYY/MM/ab/cd/<sha256><ext> with a
+StoredDocument row counting the orders that point at it. Finalising an order
+for a document that is already stored only adds a reference; the blob is
+deleted when the last referencing order goes.
+"""
+import hashlib
+import os
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import StoredDocument
+from .storage import move, shard_path
+from .uploads import PDF, UPLOAD_CHUNK_SIZE
+
+DOCUMENT_ROOT = 'documents/'
+
+
+def blob_path(sha256, ext, when=None):
+    """Storage path of the blob for a digest, sharded by date and digest prefix."""
+    return shard_path(DOCUMENT_ROOT, sha256, f"{sha256}{ext}", when)
+
+
+def file_sha256(path):
+    """Streams a stored file through SHA-256 (for items uploaded before digests were recorded)."""
+    digest = hashlib.sha256()
+    with default_storage.open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_document(temp_path, name, sha256=None, kind=PDF, pages=None, moved=None):
+    """
+    Adds one reference to the blob holding temp_path's bytes, creating the blob
+    the first time a digest is seen (with its page count, so check_upload can
+    answer for it without a parse). Returns the StoredDocument.
+
+    A new blob is renamed into place before the transaction commits, so a failed
+    rename rolls its row back instead of leaving a row without a file; the cost
+    does not depend on the file size. Each rename is appended to `moved` so a
+    caller whose own transaction later fails can put the files back with
+    restore_moved(). For a known blob the temp copy is deleted on commit.
+    """
+    sha256 = sha256 or file_sha256(temp_path)
+    created = False
+    with transaction.atomic():
+        if StoredDocument.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1):
+            doc = StoredDocument.objects.get(sha256=sha256)
+        else:
+            ext = '.pdf' if kind == PDF else os.path.splitext(name)[1].lower()
+            doc, created = StoredDocument.objects.get_or_create(sha256=sha256, defaults={
+                'file': blob_path(sha256, ext), 'kind': kind, 'size': default_storage.size(temp_path),
+                'pages': pages, 'ref_count': 1,
+            })
+            if not created:
+                # Lost a race with another finalisation of the same document
+                StoredDocument.objects.filter(pk=doc.pk).update(ref_count=F('ref_count') + 1)
+                doc.refresh_from_db()
+        if created:
+            move(temp_path, doc.file.name, replace=True)
+            if moved is not None:
+                moved.append((doc.file.name, temp_path))
+    if not created:
+        transaction.on_commit(lambda: default_storage.delete(temp_path) if default_storage.exists(temp_path) else None)
+    return doc
+
+
+def restore_moved(moved):
+    """
+    Renames blobs back to their temp paths after the transaction that created
+    their rows rolled back, so a retry of the finalisation still finds them.
+    """
+    for blob, temp_path in reversed(moved):
+        if default_storage.exists(blob) and not default_storage.exists(temp_path):
+            move(blob, temp_path)
+
+
+def release_document(document_id):
+    """Drops one reference; deletes the row and blob when none remain."""
+    with transaction.atomic():
+        StoredDocument.objects.filter(pk=document_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        doc = StoredDocument.objects.select_for_update().filter(pk=document_id, ref_count=0).first()
+        if doc is None or doc.orders.exists():
+            return False
+        path = doc.file.name
+        doc.delete()
+    default_storage.delete(path)
+    return True
+
+
+def collect_garbage(dry_run=False):
+    """
+    Reconciles ref_count with the orders that actually reference each blob
+    (bulk deletes skip Order.delete()) and removes unreferenced blobs.
+    Returns (recounted, deleted).
+    """
+    recounted, deleted = 0, 0
+    for doc in StoredDocument.objects.annotate(refs=Count('orders')).iterator():
+        if doc.refs != doc.ref_count:
+            recounted += 1
+            if not dry_run:
+                StoredDocument.objects.filter(pk=doc.pk).update(ref_count=doc.refs)
+        if doc.refs == 0:
+            deleted += 1
+            if not dry_run:
+                release_document(doc.pk)
+    return recounted, deleted
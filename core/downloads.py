@@ -0,0 +1,132 @@
+"""
+File downloads for FastCopy (dealer order files).
+
+- Conditional GET: ETag / Last-Modified, answered with 304 when unchanged.
+- Resumable downloads: a single byte range (Range / If-Range) gets 206, an
+  unsatisfiable one 416.
+- Offloading: with DOWNLOAD_OFFLOAD set, Django only checks permissions and
+  hands the transfer to the front proxy via X-Accel-Redirect (nginx) or
+  X-Sendfile (Apache / lighttpd), which then also serves ranges itself, so
+  no worker is tied up streaming a large file.
+"""
+import mimetypes
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from .uploads import UPLOAD_CHUNK_SIZE
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+X_ACCEL_REDIRECT = 'x-accel-redirect'
+X_SENDFILE = 'x-sendfile'
+
+
+def parse_range(header, size):
+    """
+    Byte range for a Range header value: (start, end) inclusive, None to send
+    the whole file (no, malformed or multi-range header), False if unsatisfiable.
+    """
+    match = RANGE_RE.match((header or '').replace(' ', ''))
+    if not match or not size:
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        if not last:
+            return None
+        length = int(last)
+        return (max(size - length, 0), size - 1) if length else False
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def _if_range_matches(request, etag, last_modified):
+    """If-Range holds an ETag or a date; a range is only honoured while it still matches."""
+    value = request.META.get('HTTP_IF_RANGE')
+    if not value:
+        return True
+    if value.startswith(('"', 'W/')):
+        return value == etag
+    return last_modified is not None and parse_http_date_safe(value) == last_modified
+
+
+def _iter_range(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(UPLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    # The browser may keep a copy but has to revalidate (cheap 304) before reusing it
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def serve_file(request, name, filename, digest=None):
+    """
+    Attachment response for a stored file, downloaded as `filename`.
+    Pass the content digest when known (strong ETag); otherwise size + mtime are used.
+    Raises FileNotFoundError if the file is gone.
+    """
+    if not default_storage.exists(name):
+        raise FileNotFoundError(name)
+    size = default_storage.size(name)
+    try:
+        last_modified = int(default_storage.get_modified_time(name).timestamp())
+    except NotImplementedError:
+        last_modified = None
+    etag = f'"{digest}"' if digest else f'"{last_modified or 0:x}-{size:x}"'
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return _set_validators(not_modified, etag, last_modified)
+
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    offload = settings.DOWNLOAD_OFFLOAD
+    byte_range = None
+    if not offload and request.META.get('HTTP_RANGE') and _if_range_matches(request, etag, last_modified):
+        byte_range = parse_range(request.META['HTTP_RANGE'], size)
+
+    if offload == X_ACCEL_REDIRECT:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.DOWNLOAD_ACCEL_PREFIX.rstrip('/') + '/' + quote(name)
+    elif offload == X_SENDFILE:
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = default_storage.path(name)
+    elif byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+        return _set_validators(response, etag, last_modified)
+    elif byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _iter_range(default_storage.open(name, 'rb'), start, end - start + 1), status=206, content_type=content_type,
+        )
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(default_storage.open(name, 'rb'), content_type=content_type)
+
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return _set_validators(response, etag, last_modified)
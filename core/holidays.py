@@ -0,0 +1,55 @@
+"""
+Process-level public holiday index for FastCopy.
+
+The holiday calendar is loaded once into a frozenset of date ordinals so the
+working-day walk in calculate_delivery_date() does no database I/O. The index
+is rebuilt only when PublicHoliday save/delete bumps the holiday version.
+"""
+import threading
+
+from .versioning import bump_version, get_version
+
+HOLIDAY_VERSION_KEY = 'core:holidays:version'
+
+_lock = threading.Lock()
+_index = {'version': None, 'ordinals': None}
+
+
+def holiday_version():
+    """
+    Returns the current holiday version token.
+    Kept in the shared cache (core/versioning.py) so a change made in one
+    worker reaches all of them within a second.
+    """
+    return get_version(HOLIDAY_VERSION_KEY)
+
+
+def bump_holiday_version():
+    """Called whenever PublicHoliday rows change: drops the loaded index."""
+    bump_version(HOLIDAY_VERSION_KEY)
+    with _lock:
+        _index['version'] = None
+        _index['ordinals'] = None
+
+
+def get_holiday_ordinals():
+    """
+    Returns a frozenset of date.toordinal() values for every public holiday.
+    Hits the database once per holiday version.
+    """
+    from .models import PublicHoliday
+
+    version = holiday_version()
+    ordinals = _index['ordinals']
+    if ordinals is None or _index['version'] != version:
+        ordinals = frozenset(d.toordinal() for d in PublicHoliday.objects.values_list('date', flat=True))
+        with _lock:
+            _index['ordinals'], _index['version'] = ordinals, version
+    return ordinals
+
+
+def is_holiday(day, ordinals=None):
+    """True if the date is a public holiday."""
+    if ordinals is None:
+        ordinals = get_holiday_ordinals()
+    return day.toordinal() in ordinals
@@ -0,0 +1,59 @@
+"""
+Backfills the materialised pricing columns on Order
+(dealer_amount, color_page_count, effective_sheets) for existing orders.
+
+Usage:
+    python manage.py backfill_order_pricing
+    python manage.py backfill_order_pricing --batch-size 5000 --all
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import Order
+from core.pricing import DEALER, get_rate_table, materialize_order_pricing
+
+PRICING_FIELDS = ['dealer_amount', 'color_page_count', 'effective_sheets']
+SOURCE_FIELDS = ['id', 'service_name', 'print_mode', 'side_type', 'pages', 'copies', 'custom_color_pages']
+
+
+class Command(BaseCommand):
+    help = "Fill dealer_amount, color_page_count and effective_sheets on successful orders in bulk_update batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows per bulk_update batch")
+        parser.add_argument('--all', action='store_true', help="Recompute orders that already have values")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        rates = get_rate_table(DEALER)
+
+        orders = Order.objects.filter(payment_status='Success')
+        if not options['all']:
+            orders = orders.filter(dealer_amount__isnull=True)
+        total = orders.count()
+        self.stdout.write(f"Found {total} orders to backfill")
+        if total == 0:
+            return
+
+        started = time.monotonic()
+        batch, updated = [], 0
+        for order in orders.only(*SOURCE_FIELDS).order_by('id').iterator(chunk_size=batch_size):
+            batch.append(materialize_order_pricing(order, rates))
+            if len(batch) >= batch_size:
+                updated += self._flush(batch, batch_size)
+                self.stdout.write(f"  {updated}/{total} orders updated")
+        updated += self._flush(batch, batch_size)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled {updated} orders in {elapsed:.1f}s ({updated / max(elapsed, 1e-6):.0f} orders/s)"
+        ))
+
+    def _flush(self, batch, batch_size):
+        if not batch:
+            return 0
+        Order.objects.bulk_update(batch, PRICING_FIELDS, batch_size=batch_size)
+        count = len(batch)
+        batch.clear()
+        return count
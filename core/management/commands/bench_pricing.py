@@ -0,0 +1,184 @@
+"""
+Micro-benchmark for the pricing engine.
+
+Prices a deterministic synthetic mix of orders (every service, B&W / colour /
+custom split, single / double, 1/4, 1/8 and 1/9 layouts, every spiral tier)
+through each pricing path and compares the result with a stored baseline.
+Any path that gets slower, or allocates more per order, than the threshold
+allows makes the command fail.
+
+Usage:
+    python manage.py bench_pricing
+    python manage.py bench_pricing --orders 50000 --threshold 15
+    python manage.py bench_pricing --save-baseline
+"""
+import json
+import platform
+import random
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Order, UserProfile
+from core.notifications import calculate_dealer_price_for_order
+from core.pricing import DEALER, LAYOUTS, SERVICE_NAMES, get_rate_table, price_order
+from core.utils import count_color_pages
+from core.views import get_user_pricing
+
+DEFAULT_BASELINE = Path(__file__).resolve().parents[2] / 'benchmarks' / 'pricing_baseline.json'
+
+# Page counts straddle every spiral tier boundary (40 / 60 / 90) and the extra-page steps
+PAGE_COUNTS = (1, 2, 7, 39, 40, 41, 59, 60, 61, 89, 90, 91, 110, 111, 150, 333)
+COLOR_RANGES = ('1', '1-3', '2,4,6-9', '1-500', '5,5,5', 'x,2-1,3', '1-10,20-30,40-60', '')
+
+
+def synthetic_orders(count, seed=2024):
+    """Unsaved Order instances covering every pricing branch."""
+    rng = random.Random(seed)
+    orders = []
+    for i in range(count):
+        service = SERVICE_NAMES[i % len(SERVICE_NAMES)]
+        colour = ''
+        if service == 'Custom Printing':
+            mode = rng.choice(LAYOUTS)
+        else:
+            mode = rng.choice(('bw', 'color', 'custom_split'))
+            if mode == 'custom_split':
+                mode = 'Custom Split (1-3)'
+                colour = rng.choice(COLOR_RANGES)
+        orders.append(Order(
+            service_name=service, print_mode=mode, side_type=rng.choice(('single', 'double')),
+            pages=rng.choice(PAGE_COUNTS), copies=rng.randint(1, 5), custom_color_pages=colour,
+            total_price=0, payment_status='Success',
+        ))
+    return orders
+
+
+def _users():
+    """One regular customer and one dealer, unsaved, so get_user_pricing resolves both tiers."""
+    users = []
+    for is_dealer in (False, True):
+        user = User(username=f"bench_{int(is_dealer)}")
+        UserProfile(user=user, is_dealer=is_dealer)
+        users.append(user)
+    return users
+
+
+def pricing_paths():
+    """name -> callable(order) for every pricing entry point being measured."""
+    dealer_rates = get_rate_table(DEALER)
+    users = _users()
+    return {
+        'get_user_pricing': lambda o: get_user_pricing(users[o.copies & 1]),
+        'dealer_dashboard': lambda o: price_order(o, rates=dealer_rates),
+        'calculate_dealer_price_for_order': calculate_dealer_price_for_order,
+        'count_color_pages': lambda o: count_color_pages(o.custom_color_pages, o.pages),
+    }
+
+
+def time_path(fn, orders, repeat):
+    """Best-of-N throughput in orders per second."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for order in orders:
+            fn(order)
+        best = min(best, time.perf_counter() - started)
+    return len(orders) / max(best, 1e-9)
+
+
+def calibration_score(repeat):
+    """
+    Throughput of a fixed pure-Python workload, measured in the same run.
+    Path scores are stored relative to it so a baseline recorded on one machine
+    (or under a different load) still compares fairly on another.
+    """
+    def workload(n=200000):
+        total = 0.0
+        for i in range(n):
+            total += (i % 7) * 1.5 if i & 1 else -(-i // 4) * 2.0
+        return total
+    return time_path(lambda _: workload(), [None], repeat)
+
+
+def bytes_per_order(fn, orders):
+    """Average peak transient allocation (bytes) of a single call, via tracemalloc."""
+    fn(orders[0])  # warm any lazily built tables outside the measurement
+    total = 0
+    tracemalloc.start()
+    try:
+        for order in orders:
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            fn(order)
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return total / len(orders)
+
+
+def find_regressions(results, baseline, threshold):
+    """Returns human readable lines for every path outside the allowed threshold (percent)."""
+    problems = []
+    limit = threshold / 100.0
+    for name, result in results.items():
+        base = baseline.get('paths', {}).get(name)
+        if not base:
+            continue
+        if result['relative'] < base['relative'] * (1 - limit):
+            drop = 100 * (1 - result['relative'] / base['relative'])
+            problems.append(f"{name}: {result['orders_per_sec']:.0f} orders/s is {drop:.1f}% slower than baseline (calibrated)")
+        # Small absolute slack so a few bytes of interpreter noise never trips it
+        if result['bytes_per_order'] > base['bytes_per_order'] * (1 + limit) + 16:
+            problems.append(f"{name}: {result['bytes_per_order']:.0f} B/order vs baseline {base['bytes_per_order']:.0f} B/order")
+    return problems
+
+
+class Command(BaseCommand):
+    help = "Benchmark every pricing path on a synthetic order mix and fail on regressions against the stored baseline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=20000, help="Synthetic orders per path")
+        parser.add_argument('--repeat', type=int, default=7, help="Timed rounds per path (best is kept)")
+        parser.add_argument('--alloc-sample', type=int, default=2000, help="Orders traced for allocation stats")
+        parser.add_argument('--threshold', type=float, default=30.0, help="Allowed slowdown / growth in percent")
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help="Baseline JSON file")
+        parser.add_argument('--save-baseline', action='store_true', help="Write these results as the new baseline")
+
+    def handle(self, *args, **options):
+        orders = synthetic_orders(options['orders'])
+        sample = orders[:max(1, min(options['alloc_sample'], len(orders)))]
+
+        calibration = calibration_score(options['repeat'])
+        results = {}
+        for name, fn in pricing_paths().items():
+            orders_per_sec = time_path(fn, orders, options['repeat'])
+            results[name] = {
+                'orders_per_sec': round(orders_per_sec, 1),
+                'relative': round(orders_per_sec / calibration, 3),
+                'bytes_per_order': round(bytes_per_order(fn, sample), 1),
+            }
+            self.stdout.write(f"  {name:<34} {results[name]['orders_per_sec']:>12.0f} orders/s {results[name]['bytes_per_order']:>8.0f} B/order")
+
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps({
+                'orders': options['orders'],
+                'python': platform.python_version(),
+                'paths': results,
+            }, indent=2, sort_keys=True) + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {baseline_path}"))
+            return
+
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f"No baseline at {baseline_path}; run with --save-baseline"))
+            return
+
+        problems = find_regressions(results, json.loads(baseline_path.read_text()), options['threshold'])
+        if problems:
+            raise CommandError("Pricing benchmark regressed:\n  " + "\n  ".join(problems))
+        self.stdout.write(self.style.SUCCESS(f"Within {options['threshold']:.0f}% of baseline"))
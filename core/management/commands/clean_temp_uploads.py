@@ -0,0 +1,56 @@
+"""
+Deletes abandoned uploads from temp/.
+
+Files land in temp/ when a document is uploaded; they move into the document
+store when an order is paid. Abandoned direct orders and removed cart items
+leave theirs behind. This streams the directory, keeps everything a CartItem
+still references or that is younger than the age limit, and deletes the rest
+in batches.
+
+Run it from cron / a systemd timer, e.g. hourly:
+    0 * * * *  cd /srv/fastcopy && python manage.py clean_temp_uploads
+
+Usage:
+    python manage.py clean_temp_uploads
+    python manage.py clean_temp_uploads --dry-run --older-than 72
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.uploads import UPLOAD_TOKEN_MAX_AGE, clean_temp_uploads
+
+
+def _mb(size):
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+class Command(BaseCommand):
+    help = "Delete temp/ uploads that no cart item references and that are older than TEMP_UPLOAD_MAX_AGE."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=None,
+                            help=f"Age limit in hours (default {settings.TEMP_UPLOAD_MAX_AGE / 3600:g})")
+        parser.add_argument('--batch-size', type=int, default=500, help="Files re-checked and deleted per batch")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        max_age = settings.TEMP_UPLOAD_MAX_AGE if options['older_than'] is None else options['older_than'] * 3600
+        if max_age < UPLOAD_TOKEN_MAX_AGE:
+            # Younger files may still be behind a valid upload token
+            self.stdout.write(self.style.WARNING(f"Age limit raised to the upload token lifetime ({UPLOAD_TOKEN_MAX_AGE / 3600:g} h)"))
+            max_age = UPLOAD_TOKEN_MAX_AGE
+
+        verb = "would be deleted" if options['dry_run'] else "deleted"
+        started = time.monotonic()
+        stats = clean_temp_uploads(
+            max_age, options['batch_size'], options['dry_run'],
+            on_batch=lambda s: self.stdout.write(f"  batch {s['batches']}: {s['deleted']} files {verb} ({_mb(s['reclaimed_bytes'])})"),
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {stats['scanned']} files ({_mb(stats['scanned_bytes'])}) in {elapsed:.1f}s: "
+            f"{stats['kept']} referenced, {stats['young']} too young, "
+            f"{stats['deleted']} {verb} reclaiming {_mb(stats['reclaimed_bytes'])}"
+        ))
@@ -0,0 +1,27 @@
+"""
+Garbage-collects the content-addressed document store.
+
+Recounts StoredDocument references from the orders that point at them and
+deletes blobs that no order references any more.
+
+Usage:
+    python manage.py gc_documents
+    python manage.py gc_documents --dry-run
+"""
+from django.core.management.base import BaseCommand
+
+from core.documents import collect_garbage
+
+
+class Command(BaseCommand):
+    help = "Fix StoredDocument reference counts and delete unreferenced document blobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would change")
+
+    def handle(self, *args, **options):
+        recounted, deleted = collect_garbage(dry_run=options['dry_run'])
+        prefix = "Would fix" if options['dry_run'] else "Fixed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {recounted} reference counts; {deleted} unreferenced documents {'found' if options['dry_run'] else 'deleted'}"
+        ))
@@ -0,0 +1,96 @@
+"""
+Moves existing files into the sharded media layout (core/storage.py).
+
+Document-store blobs go to documents/YYYY/MM/ab/cd/<sha256><ext> (date from
+StoredDocument.created_at). Order files uploaded before the document store go
+to orders/pdfs|images/YYYY/MM/ab/cd/<name> (date from Order.created_at; the
+shard key is derived from the old name). Every referencing FileField is
+rewritten in the same batch transaction. Destinations are deterministic, so
+re-running after an interruption picks up files that were already moved.
+temp/ is left alone; clean_temp_uploads ages it out.
+
+Usage:
+    python manage.py shard_media --dry-run
+    python manage.py shard_media --batch-size 200
+"""
+import hashlib
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.documents import blob_path
+from core.models import Order, StoredDocument
+from core.storage import is_sharded, move, shard_path
+
+
+def _legacy_target(field, name, created_at):
+    """Sharded destination for a pre-document-store order file, within the field's max_length."""
+    key = hashlib.sha256(name.encode()).hexdigest()
+    base, ext = os.path.splitext(os.path.basename(name))
+    target = shard_path(field.upload_to.prefix, key, base + ext, created_at)
+    overflow = len(target) - field.max_length
+    if overflow > 0:
+        target = shard_path(field.upload_to.prefix, key, base[:max(1, len(base) - overflow)] + ext, created_at)
+    return target
+
+
+class Command(BaseCommand):
+    help = "Relocate documents and order files into the sharded YYYY/MM/ab/cd layout and rewrite FileField paths in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows relocated per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would move")
+
+    def handle(self, *args, **options):
+        self.batch_size, self.dry_run = options['batch_size'], options['dry_run']
+        self.counts = {'moved': 0, 'rewritten': 0, 'missing': 0}
+        started = time.monotonic()
+
+        docs = StoredDocument.objects.values_list('id', 'file', 'sha256', 'created_at')
+        self._relocate(docs, lambda row: blob_path(row[2], os.path.splitext(row[1])[1].lower(), row[3]))
+
+        for field_name in ('document', 'image_upload'):
+            field = Order._meta.get_field(field_name)
+            legacy = (Order.objects.filter(stored_document__isnull=True).exclude(**{field_name: ''})
+                      .exclude(**{f"{field_name}__isnull": True}).values_list('id', field_name, 'created_at'))
+            self._relocate(legacy, lambda row, field=field: _legacy_target(field, row[1], row[2]))
+
+        verb = "would move" if self.dry_run else "moved"
+        self.stdout.write(self.style.SUCCESS(
+            f"{self.counts['moved']} files {verb}, {self.counts['rewritten']} paths rewritten, "
+            f"{self.counts['missing']} missing files skipped in {time.monotonic() - started:.1f}s"
+        ))
+
+    def _relocate(self, rows, target_for):
+        """Keyset-paginates (id, name, ...) rows and relocates every non-sharded name."""
+        last_id = 0
+        while True:
+            batch = list(rows.filter(id__gt=last_id).order_by('id')[:self.batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            with transaction.atomic():
+                for row in batch:
+                    name = row[1]
+                    if not name or is_sharded(name):
+                        continue
+                    self._relocate_one(name, target_for(row))
+            self.stdout.write(f"  up to id {last_id}: {self.counts['moved']} moved, {self.counts['rewritten']} rewritten")
+
+    def _relocate_one(self, name, target):
+        if default_storage.exists(name):
+            if not self.dry_run:
+                move(name, target, replace=True)
+            self.counts['moved'] += 1
+        elif not default_storage.exists(target):
+            # Neither the old file nor an earlier run's copy: leave the row pointing where it did
+            self.counts['missing'] += 1
+            return
+        if self.dry_run:
+            return
+        self.counts['rewritten'] += StoredDocument.objects.filter(file=name).update(file=target)
+        self.counts['rewritten'] += Order.objects.filter(document=name).update(document=target)
+        self.counts['rewritten'] += Order.objects.filter(image_upload=name).update(image_upload=target)
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_popupoffer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='color_page_count',
+            field=models.IntegerField(default=0, help_text='Colour pages per copy'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='dealer_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Dealer payout for this order', max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='effective_sheets',
+            field=models.IntegerField(default=0, help_text='Printed sheets across all copies'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='document',
+            field=models.FileField(blank=True, max_length=500, null=True, upload_to='orders/pdfs/'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0032_order_dealer_amount_color_page_count_effective_sheets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(max_length=500, upload_to='')),
+                ('kind', models.CharField(choices=[('pdf', 'PDF'), ('image', 'Image')], default='pdf', max_length=10)),
+                ('size', models.BigIntegerField(default=0)),
+                ('pages', models.IntegerField(blank=True, null=True)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Stored Document',
+            },
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='document_sha256',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='stored_document',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='core.storeddocument'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:07
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0033_stored_document'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='document',
+            field=models.FileField(blank=True, max_length=500, null=True, upload_to=core.storage.ShardedUploadTo('orders/pdfs/')),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='image_upload',
+            field=models.ImageField(blank=True, max_length=500, null=True, upload_to=core.storage.ShardedUploadTo('orders/images/')),
+        ),
+    ]
@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import User
 import uuid
 
+from .storage import ShardedUploadTo
+
 # --- 1. USER PROFILE MODEL ---
 
 class Location(models.Model):
@@ -105,8 +107,10 @@ class Order(models.Model):
     custom_color_pages = models.CharField(max_length=255, null=True, blank=True)
     location = models.CharField(max_length=100, null=True, blank=True)
 
-    document = models.FileField(upload_to='orders/pdfs/', max_length=500, null=True, blank=True)
-    image_upload = models.ImageField(upload_to='orders/images/', null=True, blank=True)
+    document = models.FileField(upload_to=ShardedUploadTo('orders/pdfs/'), max_length=500, null=True, blank=True)
+    image_upload = models.ImageField(upload_to=ShardedUploadTo('orders/images/'), max_length=500, null=True, blank=True)
+    # Content-addressed blob the document/image above points into (see core/documents.py)
+    stored_document = models.ForeignKey('StoredDocument', null=True, blank=True, on_delete=models.PROTECT, related_name='orders')
 
     # Pricing fields
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -116,6 +120,11 @@ class Order(models.Model):
     discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, help_text="Discount amount from coupon")
     original_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text="Original price before discount")
     
+    # Materialised at payment success (see core.pricing.materialize_order_pricing)
+    dealer_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text="Dealer payout for this order")
+    color_page_count = models.IntegerField(default=0, help_text="Colour pages per copy")
+    effective_sheets = models.IntegerField(default=0, help_text="Printed sheets across all copies")
+    
     payment_status = models.CharField(
         max_length=20, 
         choices=[('Pending', 'Pending'), ('Success', 'Success'), ('Failed', 'Failed')],
@@ -139,7 +148,7 @@ class Order(models.Model):
     estimated_delivery_date = models.DateField(null=True, blank=True)
 
     def save(self, *args, **kwargs):
-        from .utils import calculate_delivery_date
+        from .utils import get_delivery_date
         from django.utils import timezone
         
         is_new = self._state.adding
@@ -157,7 +166,7 @@ class Order(models.Model):
         
         # Calculate estimated delivery date for new orders (if not already set)
         if is_new and not self.estimated_delivery_date:
-            self.estimated_delivery_date = calculate_delivery_date(timezone.now())
+            self.estimated_delivery_date = get_delivery_date(timezone.now())
 
         super().save(*args, **kwargs)
 
@@ -169,6 +178,15 @@ class Order(models.Model):
     def __str__(self): 
         return f"[{self.order_source}] {self.order_id}"
 
+    def delete(self, *args, **kwargs):
+        from .documents import release_document
+        stored_document_id = self.stored_document_id
+        result = super().delete(*args, **kwargs)
+        # Drop this order's reference; the blob goes when the last one does
+        if stored_document_id:
+            release_document(stored_document_id)
+        return result
+
     class Meta:
         ordering = ['-created_at']
 
@@ -187,6 +205,7 @@ class CartItem(models.Model):
     print_mode = models.CharField(max_length=50, null=True, blank=True)
     side_type = models.CharField(max_length=50, default='single')
     custom_color_pages = models.TextField(null=True, blank=True, default="")
+    document_sha256 = models.CharField(max_length=64, blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -316,20 +335,73 @@ class PricingConfig(models.Model):
         return config
     
     def save(self, *args, **kwargs):
+        from .pricing import bump_pricing_version
         self.pk = 1
         super().save(*args, **kwargs)
+        # Recompile the shared rate tables on next use (see core/pricing.py)
+        bump_pricing_version()
+
+# --- 6. STORED DOCUMENTS ---
+class StoredDocument(models.Model):
+    """
+    One row (and one file) per distinct document, keyed by SHA-256.
+    Orders reference it instead of keeping their own copy; ref_count tracks
+    how many orders point here so the blob is deleted with the last one.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(max_length=500)
+    kind = models.CharField(max_length=10, choices=[('pdf', 'PDF'), ('image', 'Image')], default='pdf')
+    size = models.BigIntegerField(default=0)
+    pages = models.IntegerField(null=True, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Stored Document"
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} refs)"
 
 # --- 7. PUBLIC HOLIDAYS ---
+class PublicHolidayQuerySet(models.QuerySet):
+    """Bulk deletes/updates (e.g. the admin "delete selected" action) also invalidate the holiday index."""
+    def delete(self):
+        from .holidays import bump_holiday_version
+        result = super().delete()
+        bump_holiday_version()
+        return result
+
+    def update(self, **kwargs):
+        from .holidays import bump_holiday_version
+        result = super().update(**kwargs)
+        bump_holiday_version()
+        return result
+
+
 class PublicHoliday(models.Model):
     date = models.DateField(unique=True)
     name = models.CharField(max_length=100)
     
+    objects = PublicHolidayQuerySet.as_manager()
+    
     class Meta:
         ordering = ['date']
 
     def __str__(self):
         return f"{self.name} ({self.date})"
 
+    def save(self, *args, **kwargs):
+        from .holidays import bump_holiday_version
+        super().save(*args, **kwargs)
+        # Reload the in-memory holiday index on next use (see core/holidays.py)
+        bump_holiday_version()
+
+    def delete(self, *args, **kwargs):
+        from .holidays import bump_holiday_version
+        result = super().delete(*args, **kwargs)
+        bump_holiday_version()
+        return result
+
 
 # --- 8. COUPON SYSTEM ---
 class Coupon(models.Model):
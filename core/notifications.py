@@ -16,89 +16,13 @@ logger = logging.getLogger(__name__)
 def calculate_dealer_price_for_order(order):
     """
     Calculate dealer price for an order (what dealer earns)
-    Uses dealer pricing rates instead of admin rates
+    Reads the amount materialised at payment time, pricing it only for older orders
     """
-    from core.models import PricingConfig
+    from core.pricing import price_order, DEALER
     
-    config = PricingConfig.get_config()
-    
-    # Use dealer pricing
-    pricing = {
-        'price_per_page': float(config.dealer_price_per_page),
-        'price_per_page_double': float(config.dealer_price_per_page_double),
-        'color_addition': float(config.color_price_addition_dealer),
-        'color_addition_double': float(config.color_price_addition_dealer_double),
-        'custom_1_4_price': float(config.custom_1_4_price_dealer),
-        'custom_1_8_price': float(config.custom_1_8_price_dealer),
-        'custom_1_9_price': float(config.custom_1_9_price_dealer),
-        'spiral_tier1_limit': config.spiral_tier1_limit,
-        'spiral_tier2_limit': config.spiral_tier2_limit,
-        'spiral_tier3_limit': config.spiral_tier3_limit,
-        'spiral_tier1_price': float(config.spiral_tier1_price_dealer),
-        'spiral_tier2_price': float(config.spiral_tier2_price_dealer),
-        'spiral_tier3_price': float(config.spiral_tier3_price_dealer),
-        'spiral_extra_price': float(config.spiral_extra_price_dealer),
-        'soft_binding': float(config.soft_binding_price_dealer),
-    }
-    
-    cost = 0.0
-    pages, copies = order.pages, order.copies
-    
-    if order.service_name == "Custom Printing":
-        layout = order.print_mode or ""
-        divisor, rate = 4, pricing['custom_1_4_price']
-        if "1/8" in layout:
-            divisor, rate = 8, pricing['custom_1_8_price']
-        elif "1/9" in layout:
-            divisor, rate = 9, pricing['custom_1_9_price']
-        sheets = -(-pages // divisor)
-        cost = sheets * rate * copies
-    else:
-        # Determine if it's single or double-sided
-        is_double_sided = hasattr(order, 'side_type') and order.side_type == 'double'
-        
-        # Check for custom split mode (some pages color, some B&W)
-        if 'custom' in str(order.print_mode).lower() and 'split' in str(order.print_mode).lower():
-            from .utils import count_color_pages
-            
-            # Count how many pages are color vs B&W
-            color_page_count = count_color_pages(order.custom_color_pages, pages)
-            bw_page_count = pages - color_page_count
-            
-            # Get rates for both types
-            color_rate = pricing['color_addition_double'] if is_double_sided else pricing['color_addition']
-            bw_rate = pricing['price_per_page_double'] if is_double_sided else pricing['price_per_page']
-            
-            # Calculate split cost: (color pages × color rate) + (B&W pages × B&W rate)
-            cost = ((color_page_count * color_rate) + (bw_page_count * bw_rate)) * copies
-        elif order.print_mode == 'color':
-            # All pages are color
-            # Use ONLY color price from configuration (not B&W + color)
-            print_rate = pricing['color_addition_double'] if is_double_sided else pricing['color_addition']
-            cost = pages * copies * print_rate
-        else:
-            # All pages are B&W
-            # Use B&W price for black and white prints
-            print_rate = pricing['price_per_page_double'] if is_double_sided else pricing['price_per_page']
-            cost = pages * copies * print_rate
-
-    
-    # Add binding costs
-    if "Spiral" in order.service_name:
-        t1, t2, t3 = pricing['spiral_tier1_limit'], pricing['spiral_tier2_limit'], pricing['spiral_tier3_limit']
-        if pages <= t1:
-            binding = pricing['spiral_tier1_price']
-        elif pages <= t2:
-            binding = pricing['spiral_tier2_price']
-        elif pages <= t3:
-            binding = pricing['spiral_tier3_price']
-        else:
-            binding = pricing['spiral_tier3_price'] + ((-(-(pages-t3)//20)) * pricing['spiral_extra_price'])
-        cost += (binding * copies)
-    elif "Soft" in order.service_name:
-        cost += (pricing['soft_binding'] * copies)
-    
-    return round(cost, 2)
+    if order.dealer_amount is not None:
+        return float(order.dealer_amount)
+    return round(price_order(order, DEALER), 2)
 
 
 
@@ -0,0 +1,570 @@
+"""
+Pricing engine for FastCopy.
+
+Compiles the PricingConfig singleton once into read-only per-tier rate tables
+(admin / dealer) and prices orders against them. The tables are rebuilt only
+when PricingConfig.save() bumps the pricing version, so checkout, the dealer
+dashboard and the notification emails never re-query the config or rebuild
+price dicts per order.
+"""
+import hashlib
+import json
+import threading
+import time
+from types import MappingProxyType
+
+from django.core.cache import cache
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Floor
+
+from .utils import clip_page_ranges, count_color_pages, format_page_ranges, parse_page_ranges
+from .versioning import bump_version, get_version
+
+ADMIN = 'admin'
+DEALER = 'dealer'
+TIERS = (ADMIN, DEALER)
+
+PRICING_VERSION_KEY = 'core:pricing:version'
+QUOTE_CACHE_PREFIX = 'core:quote'
+QUOTE_CACHE_TTL = 60 * 10  # seconds
+PRICING_BUNDLE_GLOBAL = 'FASTCOPY_PRICING'
+CHECKOUT_TOTALS_SESSION_KEY = 'checkout_totals'
+CHECKOUT_TOTALS_TTL = 60 * 5  # seconds; bounds how stale coupon validity can get
+
+SERVICE_NAMES = ('Printing', 'Spiral Binding', 'Soft Binding', 'Custom Printing')
+PRINT_MODES = ('bw', 'color', 'custom_split')
+LAYOUTS = ('1/4', '1/8', '1/9')
+
+# Rate-table key -> PricingConfig field prefix/suffix per tier.
+# Kept identical to the keys historically returned by get_user_pricing().
+_TIER_FIELDS = {
+    'price_per_page': ('dealer_price_per_page', 'admin_price_per_page'),
+    'price_per_page_double': ('dealer_price_per_page_double', 'admin_price_per_page_double'),
+    'soft_binding': ('soft_binding_price_dealer', 'soft_binding_price_admin'),
+    'color_addition': ('color_price_addition_dealer', 'color_price_addition_admin'),
+    'color_addition_double': ('color_price_addition_dealer_double', 'color_price_addition_admin_double'),
+    'spiral_tier1_price': ('spiral_tier1_price_dealer', 'spiral_tier1_price_admin'),
+    'spiral_tier2_price': ('spiral_tier2_price_dealer', 'spiral_tier2_price_admin'),
+    'spiral_tier3_price': ('spiral_tier3_price_dealer', 'spiral_tier3_price_admin'),
+    'spiral_extra_price': ('spiral_extra_price_dealer', 'spiral_extra_price_admin'),
+    'custom_1_4_price': ('custom_1_4_price_dealer', 'custom_1_4_price_admin'),
+    'custom_1_8_price': ('custom_1_8_price_dealer', 'custom_1_8_price_admin'),
+    'custom_1_9_price': ('custom_1_9_price_dealer', 'custom_1_9_price_admin'),
+    'custom_1_8_price_double': ('custom_1_8_price_double_dealer', 'custom_1_8_price_double_admin'),
+    'custom_1_9_price_double': ('custom_1_9_price_double_dealer', 'custom_1_9_price_double_admin'),
+    'delivery_charge': ('delivery_price_dealer', 'delivery_price_admin'),
+}
+
+_SHARED_FIELDS = ('spiral_tier1_limit', 'spiral_tier2_limit', 'spiral_tier3_limit')
+
+_lock = threading.Lock()
+_compiled = {'version': None, 'tables': None}
+_bundle = {'version': None, 'value': None}
+
+
+# --- 🔖 1. VERSIONING ---
+
+def pricing_version():
+    """
+    Returns the current pricing version token.
+    The token lives in the shared cache (core/versioning.py), so every worker
+    sees a bump made by any other within a second.
+    """
+    return get_version(PRICING_VERSION_KEY)
+
+
+def bump_pricing_version():
+    """Called from PricingConfig.save(): invalidates every compiled rate table."""
+    bump_version(PRICING_VERSION_KEY)
+    with _lock:
+        _compiled['version'] = None
+        _compiled['tables'] = None
+        _bundle['version'] = None
+
+
+# --- 🧮 2. RATE TABLES ---
+
+def compile_rate_tables(config):
+    """
+    Converts a PricingConfig instance into {tier: read-only rate table}.
+    Every Decimal is converted to float exactly once here.
+    """
+    tables = {}
+    for tier in TIERS:
+        is_dealer = tier == DEALER
+        rates = {
+            key: float(getattr(config, dealer_field if is_dealer else admin_field))
+            for key, (dealer_field, admin_field) in _TIER_FIELDS.items()
+        }
+        for field in _SHARED_FIELDS:
+            rates[field] = getattr(config, field)
+        rates['is_dealer'] = is_dealer
+        tables[tier] = MappingProxyType(rates)
+    return tables
+
+
+def get_rate_table(tier=ADMIN):
+    """
+    Returns the compiled rate table for a tier ('admin' or 'dealer').
+    Only touches the database when the pricing version has changed.
+    """
+    version = pricing_version()
+    tables = _compiled['tables']
+    if tables is None or _compiled['version'] != version:
+        from .models import PricingConfig
+        # Loaded outside the lock: get_config() may create the row, and that
+        # save() bumps the version (taking the lock). Stamping with the version
+        # read beforehand just means one extra recompile in that case.
+        tables = compile_rate_tables(PricingConfig.get_config())
+        with _lock:
+            _compiled['tables'], _compiled['version'] = tables, version
+    return tables[tier]
+
+
+def tier_for_user(user):
+    """Dealers are billed on the dealer tier, everyone else on the admin tier."""
+    try:
+        return DEALER if user.profile.is_dealer else ADMIN
+    except Exception:
+        return ADMIN
+
+
+# --- 💰 3. ORDER PRICING ---
+
+def _field(order_like, name, default=None):
+    if isinstance(order_like, dict):
+        return order_like.get(name, default)
+    return getattr(order_like, name, default)
+
+
+def spiral_binding_price(pages, rates):
+    """Tiered spiral binding price for one copy."""
+    t1, t2, t3 = rates['spiral_tier1_limit'], rates['spiral_tier2_limit'], rates['spiral_tier3_limit']
+    if pages <= t1: return rates['spiral_tier1_price']
+    if pages <= t2: return rates['spiral_tier2_price']
+    if pages <= t3: return rates['spiral_tier3_price']
+    return rates['spiral_tier3_price'] + ((-(-(pages - t3) // 20)) * rates['spiral_extra_price'])
+
+
+def price_order(order_like, tier=ADMIN, rates=None):
+    """
+    Prices a single order (an Order, CartItem or an item dict) for a tier.
+    Returns the unrounded item cost, excluding the per-order delivery charge.
+
+    This is the settlement formula used for dealer payouts and emails:
+    - Custom Printing: ceil(pages / layout) sheets x layout rate x copies
+    - Custom Split: colour pages at colour rate + remaining pages at B&W rate
+    - Colour / B&W: pages x copies x rate (single or double side rate)
+    - Spiral / Soft binding added per copy
+    """
+    if rates is None:
+        rates = get_rate_table(tier)
+
+    service_name = _field(order_like, 'service_name') or ""
+    print_mode = _field(order_like, 'print_mode')
+    pages, copies = _field(order_like, 'pages'), _field(order_like, 'copies')
+
+    if service_name == "Custom Printing":
+        layout = print_mode or ""
+        divisor, rate = 4, rates['custom_1_4_price']
+        if "1/8" in layout: divisor, rate = 8, rates['custom_1_8_price']
+        elif "1/9" in layout: divisor, rate = 9, rates['custom_1_9_price']
+        sheets = -(-pages // divisor)
+        cost = sheets * rate * copies
+    else:
+        is_double_sided = _field(order_like, 'side_type') == 'double'
+        mode = str(print_mode).lower()
+
+        if 'custom' in mode and 'split' in mode:
+            color_page_count = count_color_pages(_field(order_like, 'custom_color_pages'), pages)
+            bw_page_count = pages - color_page_count
+            color_rate = rates['color_addition_double'] if is_double_sided else rates['color_addition']
+            bw_rate = rates['price_per_page_double'] if is_double_sided else rates['price_per_page']
+            cost = ((color_page_count * color_rate) + (bw_page_count * bw_rate)) * copies
+        elif print_mode == 'color':
+            print_rate = rates['color_addition_double'] if is_double_sided else rates['color_addition']
+            cost = pages * copies * print_rate
+        else:
+            print_rate = rates['price_per_page_double'] if is_double_sided else rates['price_per_page']
+            cost = pages * copies * print_rate
+
+    if "Spiral" in service_name:
+        cost += spiral_binding_price(pages, rates) * copies
+    elif "Soft" in service_name:
+        cost += rates['soft_binding'] * copies
+    return cost
+
+
+def color_page_count(order_like):
+    """Colour pages per copy: all pages for colour, the parsed ranges for custom split."""
+    if _field(order_like, 'service_name') == "Custom Printing":
+        return 0
+    print_mode = _field(order_like, 'print_mode')
+    pages = _field(order_like, 'pages') or 0
+    mode = str(print_mode).lower()
+    if 'custom' in mode and 'split' in mode:
+        return count_color_pages(_field(order_like, 'custom_color_pages'), pages)
+    return pages if print_mode == 'color' else 0
+
+
+def effective_sheets(order_like):
+    """Physical sheets printed across all copies (N-up layouts and double side folded in)."""
+    pages = _field(order_like, 'pages') or 0
+    copies = _field(order_like, 'copies') or 1
+    if _field(order_like, 'service_name') == "Custom Printing":
+        layout = _field(order_like, 'print_mode') or ""
+        divisor = 8 if "1/8" in layout else 9 if "1/9" in layout else 4
+        sheets = -(-pages // divisor)
+    elif _field(order_like, 'side_type') == 'double':
+        sheets = -(-pages // 2)
+    else:
+        sheets = pages
+    return sheets * copies
+
+
+def materialize_order_pricing(order, rates=None):
+    """
+    Fills the persisted dealer_amount / color_page_count / effective_sheets
+    columns on an Order so read paths never re-parse or re-price it.
+    Does not save; callers save or bulk_update.
+    """
+    if rates is None:
+        rates = get_rate_table(DEALER)
+    order.dealer_amount = round(price_order(order, rates=rates), 2)
+    order.color_page_count = color_page_count(order)
+    order.effective_sheets = effective_sheets(order)
+    return order
+
+
+# --- 🗄️ 4. DATABASE-SIDE PRICING ---
+# The same formula as price_order(), expressed as a Case/When so revenue can be
+# aggregated by the database instead of materialising every order in Python.
+
+SPLIT_MODE_Q = Q(print_mode__icontains='custom') & Q(print_mode__icontains='split')
+
+
+def _ceil_div(expression, divisor):
+    return Floor(ExpressionWrapper((expression + (divisor - 1)) * Value(1.0) / divisor, output_field=FloatField()))
+
+
+def _rate(value):
+    return Value(float(value), output_field=FloatField())
+
+
+def order_price_expression(rates):
+    """
+    Per-row price expression for the Order table (custom split rows excluded).
+    Custom split needs the parsed colour-page count, so those rows are priced
+    by sum_order_prices() in Python from a narrow values_list().
+    """
+    pages, copies = F('pages'), F('copies')
+    is_double = Q(side_type='double')
+
+    printing = Case(
+        When(Q(service_name="Custom Printing") & Q(print_mode__contains="1/8"),
+             then=_ceil_div(pages, 8) * _rate(rates['custom_1_8_price']) * copies),
+        When(Q(service_name="Custom Printing") & Q(print_mode__contains="1/9"),
+             then=_ceil_div(pages, 9) * _rate(rates['custom_1_9_price']) * copies),
+        When(service_name="Custom Printing",
+             then=_ceil_div(pages, 4) * _rate(rates['custom_1_4_price']) * copies),
+        When(Q(print_mode='color') & is_double, then=pages * copies * _rate(rates['color_addition_double'])),
+        When(print_mode='color', then=pages * copies * _rate(rates['color_addition'])),
+        When(is_double, then=pages * copies * _rate(rates['price_per_page_double'])),
+        default=pages * copies * _rate(rates['price_per_page']),
+        output_field=FloatField(),
+    )
+
+    t3 = rates['spiral_tier3_limit']
+    spiral = Case(
+        When(pages__lte=rates['spiral_tier1_limit'], then=_rate(rates['spiral_tier1_price'])),
+        When(pages__lte=rates['spiral_tier2_limit'], then=_rate(rates['spiral_tier2_price'])),
+        When(pages__lte=t3, then=_rate(rates['spiral_tier3_price'])),
+        default=_rate(rates['spiral_tier3_price']) + _ceil_div(pages - t3, 20) * _rate(rates['spiral_extra_price']),
+        output_field=FloatField(),
+    )
+    binding = Case(
+        When(service_name__contains="Spiral", then=spiral * copies),
+        When(service_name__contains="Soft", then=_rate(rates['soft_binding']) * copies),
+        default=_rate(0),
+        output_field=FloatField(),
+    )
+    return ExpressionWrapper(printing + binding, output_field=FloatField())
+
+
+def sum_order_prices(queryset, tier=ADMIN, rates=None):
+    """
+    Total of price_order() over an Order queryset, computed with one SQL
+    aggregate plus a narrow Python pass over custom split rows only.
+    """
+    if rates is None:
+        rates = get_rate_table(tier)
+
+    is_split = SPLIT_MODE_Q & ~Q(service_name="Custom Printing")
+    total = queryset.exclude(is_split).aggregate(
+        total=Sum(order_price_expression(rates))
+    )['total'] or 0.0
+
+    split_rows = queryset.filter(is_split).values_list(
+        'service_name', 'print_mode', 'side_type', 'pages', 'copies', 'custom_color_pages'
+    )
+    fields = ('service_name', 'print_mode', 'side_type', 'pages', 'copies', 'custom_color_pages')
+    for row in split_rows.iterator():
+        total += price_order(dict(zip(fields, row)), rates=rates)
+    return total
+
+
+# --- 🧾 5. CUSTOMER QUOTES ---
+# Server-authoritative version of calculateFinalPrice() in services.html.
+# Quotes are cached (LRU/TTL via the Django cache) on the normalised
+# parameters plus the pricing version, so repeated keystrokes in the browser
+# and the re-quote done by add_to_cart / order_now are a cache hit.
+
+class QuoteError(ValueError):
+    """Raised when quote parameters are missing or inconsistent."""
+
+
+def normalize_quote_params(data):
+    """
+    Validates raw request data (QueryDict or dict) into a canonical tuple:
+    (service_name, print_mode, side_type, pages, copies, layout, color_pages).
+    Fields that do not affect the price are blanked so equivalent requests
+    share one cache entry.
+    """
+    service_name = data.get('service_name') or 'Printing'
+    if service_name not in SERVICE_NAMES:
+        raise QuoteError("Unknown service")
+
+    try:
+        pages = int(data.get('pages') or data.get('page_count') or 0)
+        copies = int(data.get('copies') or 1)
+    except (TypeError, ValueError):
+        raise QuoteError("Pages and copies must be whole numbers")
+    if pages < 0 or copies < 1:
+        raise QuoteError("Pages and copies must be positive")
+
+    print_mode = data.get('print_mode') or 'bw'
+    side_type = 'double' if data.get('side_type') == 'double' else 'single'
+    layout, color_pages = '', ''
+
+    if service_name == "Custom Printing":
+        print_mode = ''
+        layout = data.get('layout_type') or data.get('layout') or '1/4'
+        if layout not in LAYOUTS:
+            raise QuoteError("Unknown layout")
+        if layout == '1/4':
+            side_type = 'double'
+    else:
+        if print_mode not in PRINT_MODES:
+            raise QuoteError("Unknown print type")
+        if print_mode == 'custom_split':
+            side_type = 'single'
+            intervals = parse_page_ranges(data.get('custom_color_pages'))
+            highest = intervals[-1][1] if intervals else 0
+            if pages > 0 and highest > pages:
+                raise QuoteError(f"Page {highest} exceeds the total count of {pages} pages in your PDF.")
+            color_pages = format_page_ranges(clip_page_ranges(intervals, pages) if pages else intervals)
+
+    return (service_name, print_mode, side_type, pages, copies, layout, color_pages)
+
+
+def quote_line_item(params, rates):
+    """
+    Prices a normalised line item exactly as the services page displays it.
+    Returns the cost breakdown and 'payable', the whole-rupee amount stored
+    as the item's total_price.
+    """
+    service_name, print_mode, side_type, pages, copies, layout, color_pages = params
+    bw_part = color_part = 0.0
+
+    if service_name == "Custom Printing":
+        divisor = {'1/8': 8, '1/9': 9}.get(layout, 4)
+        sides = -(-pages // divisor)
+        if layout == '1/4':
+            per_set = sides * rates['custom_1_4_price']
+        elif side_type == 'double':
+            rate = rates['custom_1_8_price_double'] if layout == '1/8' else rates['custom_1_9_price_double']
+            per_set = -(-sides // 2) * rate
+        else:
+            rate = rates['custom_1_8_price'] if layout == '1/8' else rates['custom_1_9_price']
+            per_set = sides * rate
+        bw_part = per_set
+    elif print_mode == 'custom_split':
+        color_count = count_color_pages(color_pages, pages)
+        color_part = color_count * rates['color_addition']
+        bw_part = (pages - color_count) * rates['price_per_page']
+        per_set = color_part + bw_part
+    elif print_mode == 'color':
+        per_set = pages * rates['color_addition'] if side_type == 'single' else -(-pages // 2) * rates['color_addition_double']
+        color_part = per_set
+    else:
+        per_set = pages * rates['price_per_page'] if side_type == 'single' else -(-pages // 2) * rates['price_per_page_double']
+        bw_part = per_set
+
+    binding = 0.0
+    if pages > 0:
+        if service_name == "Spiral Binding": binding = spiral_binding_price(pages, rates)
+        elif service_name == "Soft Binding": binding = rates['soft_binding']
+
+    total = per_set * copies + binding * copies
+    return {
+        'bw_cost': round(bw_part * copies, 2),
+        'color_cost': round(color_part * copies, 2),
+        'binding_cost': round(binding, 2),
+        'total': round(total, 2),
+        'payable': int(total + 0.5),  # Math.round() in the browser
+    }
+
+
+def line_item_fields(params):
+    """
+    Cart item / order fields for a normalised line item, so what is stored is
+    exactly what was quoted and price_order() re-prices the same thing later.
+    price_order() reads a Custom Printing layout from print_mode.
+    """
+    service_name, print_mode, side_type, pages, copies, layout, color_pages = params
+    return {
+        'service_name': service_name,
+        'print_mode': layout if service_name == "Custom Printing" else print_mode,
+        'side_type': side_type,
+        'pages': pages,
+        'copies': copies,
+        'custom_color_pages': color_pages,
+    }
+
+
+def get_quote(data, tier=ADMIN):
+    """
+    Normalises request data and returns the (cached) quote for a tier.
+    Raises QuoteError for invalid input.
+    """
+    params = normalize_quote_params(data)
+    raw_key = repr((tier, params)).encode()
+    key = f"{QUOTE_CACHE_PREFIX}:{pricing_version()}:{hashlib.sha1(raw_key).hexdigest()}"
+
+    quote = cache.get(key)
+    if quote is None:
+        quote = quote_line_item(params, get_rate_table(tier))
+        cache.set(key, quote, QUOTE_CACHE_TTL)
+    return quote
+
+
+# --- 🛒 6. CHECKOUT TOTALS ---
+# One CheckoutTotals computation shared by the checkout summary, coupon
+# apply/remove and payment initiation. Memoised in the session under a
+# fingerprint of (cart contents, tier, coupon code, pricing version), so a
+# checkout only re-sums the cart and re-reads the coupon when one changes.
+
+def checkout_fingerprint(items, tier, coupon_code):
+    payload = json.dumps([items, tier, coupon_code or '', pricing_version()], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def compute_checkout_totals(items, tier, coupon_code=None):
+    """
+    CheckoutTotals for a list of session item dicts, as a JSON-safe dict:
+    items_total, delivery_charge, original_total, discount_amount,
+    grand_total, total_pages and the coupon outcome.
+    """
+    from .models import Coupon
+
+    items_total = sum(float(i.get('total_price', 0)) for i in items)
+    delivery_charge = get_rate_table(tier)['delivery_charge']
+    original_total = items_total + delivery_charge
+
+    totals = {
+        'items_total': items_total,
+        'delivery_charge': delivery_charge,
+        'original_total': original_total,
+        'grand_total': original_total,
+        'discount_amount': 0.0,
+        'discount_percentage': 0.0,
+        'total_pages': sum(int(i.get('pages', 1)) * int(i.get('copies', 1)) for i in items),
+        'coupon_code': None,
+        'coupon_exists': False,
+        'coupon_valid': False,
+        'coupon_message': None,
+        'expires_at': time.time() + CHECKOUT_TOTALS_TTL,
+    }
+
+    if coupon_code:
+        coupon = Coupon.objects.filter(code=coupon_code.upper()).first()
+        if coupon:
+            totals['coupon_exists'] = True
+            can_apply, message = coupon.can_apply_to_order(original_total)
+            if can_apply:
+                discount_amount, _ = coupon.calculate_discount(original_total)
+                totals.update({
+                    'coupon_code': coupon.code,
+                    'coupon_valid': True,
+                    'discount_amount': discount_amount,
+                    'discount_percentage': float(coupon.discount_percentage),
+                    'grand_total': original_total - discount_amount,
+                    'expires_at': min(totals['expires_at'], coupon.valid_until.timestamp()),
+                })
+            else:
+                totals['coupon_message'] = message
+    return totals
+
+
+def get_checkout_totals(request, items, coupon_code=None):
+    """
+    Memoised CheckoutTotals for the current request.
+    coupon_code defaults to the coupon applied in the session.
+    """
+    if coupon_code is None:
+        coupon_code = request.session.get('applied_coupon_code')
+    tier = tier_for_user(request.user)
+    fingerprint = checkout_fingerprint(items, tier, coupon_code)
+
+    cached = request.session.get(CHECKOUT_TOTALS_SESSION_KEY)
+    if cached and cached.get('fingerprint') == fingerprint and cached['totals']['expires_at'] > time.time():
+        return cached['totals']
+
+    totals = compute_checkout_totals(items, tier, coupon_code)
+    request.session[CHECKOUT_TOTALS_SESSION_KEY] = {'fingerprint': fingerprint, 'totals': totals}
+    return totals
+
+
+# --- 📦 7. BROWSER PRICING BUNDLE ---
+# The services page loads its price constants from a small JS asset whose URL
+# carries a content hash, so browsers and proxies can cache it forever and a
+# price change simply produces a new URL.
+
+def pricing_bundle_data(rates):
+    """Constants used by calculateFinalPrice() in services.html."""
+    return {
+        'price_bw': rates['price_per_page'],
+        'price_bw_double': rates['price_per_page_double'],
+        'price_color': rates['color_addition'],
+        'price_color_double': rates['color_addition_double'],
+        'spiral_tier1_limit': rates['spiral_tier1_limit'],
+        'spiral_tier2_limit': rates['spiral_tier2_limit'],
+        'spiral_tier3_limit': rates['spiral_tier3_limit'],
+        'spiral_tier1': rates['spiral_tier1_price'],
+        'spiral_tier2': rates['spiral_tier2_price'],
+        'spiral_tier3': rates['spiral_tier3_price'],
+        'spiral_extra': rates['spiral_extra_price'],
+        'spiral_extra_pages': 20,
+        'soft_binding': rates['soft_binding'],
+        'custom_1_4': rates['custom_1_4_price'],
+        'custom_1_8': rates['custom_1_8_price'],
+        'custom_1_9': rates['custom_1_9_price'],
+        'custom_1_8_double': rates['custom_1_8_price_double'],
+        'custom_1_9_double': rates['custom_1_9_price_double'],
+    }
+
+
+def get_pricing_bundle():
+    """
+    Returns (digest, js_source) for the public (admin tier) pricing bundle.
+    Rebuilt only when the pricing version changes.
+    """
+    version = pricing_version()
+    value = _bundle['value']
+    if value is None or _bundle['version'] != version:
+        payload = json.dumps(pricing_bundle_data(get_rate_table(ADMIN)), sort_keys=True)
+        digest = hashlib.sha256(payload.encode()).hexdigest()[:16]
+        value = (digest, f"window.{PRICING_BUNDLE_GLOBAL} = {payload};\n")
+        with _lock:
+            _bundle['value'], _bundle['version'] = value, version
+    return value
@@ -0,0 +1,126 @@
+"""
+Storage helpers for FastCopy.
+
+Layout: uploads and documents are sharded as prefix/YYYY/MM/ab/cd/<file>
+(see shard_path), so no directory grows past a few thousand entries and
+backups / rsync can work month by month.
+
+move() relocates a stored file as cheaply as the backend allows, so that
+finalising an order is a metadata operation instead of a copy of every byte:
+- FileSystemStorage: os.replace(), an atomic rename within one filesystem,
+- backends that provide their own move(name, dest) (e.g. a server-side copy
+  on an object store) use it,
+- anything else falls back to a streamed copy followed by a delete.
+
+link() gives a stored file a second name the same way: a hard link on
+FileSystemStorage (falling back to a copy across filesystems), the backend's
+own link(name, dest) if it has one, otherwise a streamed copy.
+"""
+import errno
+import os
+import re
+import shutil
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+SHARDED_RE = re.compile(r'/\d{4}/\d{2}/[0-9a-f]{2}/[0-9a-f]{2}/[^/]+$')
+
+
+def shard_path(prefix, key, filename, when=None):
+    """
+    prefix/YYYY/MM/ab/cd/filename, where ab/cd are the first hex digits of `key`
+    (a content digest or a uuid) and the date is local time (now by default).
+    """
+    when = timezone.localtime(when) if when else timezone.localtime()
+    return f"{prefix.rstrip('/')}/{when:%Y/%m}/{key[:2]}/{key[2:4]}/{filename}"
+
+
+def is_sharded(name):
+    """True if a stored name already follows the sharded layout."""
+    return bool(SHARDED_RE.search(name or ''))
+
+
+@deconstructible
+class ShardedUploadTo:
+    """upload_to for FileFields: shards files saved through the field (e.g. from the admin)."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def __call__(self, instance, filename):
+        return shard_path(self.prefix, uuid.uuid4().hex, filename)
+
+    def __eq__(self, other):
+        return isinstance(other, ShardedUploadTo) and other.prefix == self.prefix
+
+
+def move(name, dest, replace=False, storage=None):
+    """
+    Moves a stored file to dest and returns its final name.
+    With replace=True an existing dest is overwritten (content-addressed paths,
+    where it can only hold the same bytes); otherwise a free name is picked like save() does.
+    """
+    storage = storage or default_storage
+    if not replace:
+        dest = storage.get_available_name(dest)
+
+    native = getattr(storage, 'move', None)
+    if native is not None:
+        return native(name, dest)
+
+    try:
+        source, target = storage.path(name), storage.path(dest)
+    except NotImplementedError:
+        source = target = None
+    if source:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(source, target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(source, target)  # MEDIA_ROOT spans filesystems: copy + unlink
+        return dest
+
+    if replace and storage.exists(dest):
+        storage.delete(dest)
+    with storage.open(name, 'rb') as f:
+        dest = storage.save(dest, File(f, name=os.path.basename(dest)))
+    storage.delete(name)
+    return dest
+
+
+def link(name, dest, storage=None):
+    """
+    Gives a stored file a second name, dest (a free name is picked like save() does),
+    and returns it. Both names can then be moved or deleted independently.
+    """
+    storage = storage or default_storage
+    dest = storage.get_available_name(dest)
+
+    native = getattr(storage, 'link', None)
+    if native is not None:
+        return native(name, dest)
+
+    try:
+        source, target = storage.path(name), storage.path(dest)
+    except NotImplementedError:
+        source = target = None
+    if source:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(source, target)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            shutil.copyfile(source, target)  # no hard links here: copy
+        else:
+            os.utime(target)  # the link shares the inode's mtime; age it from now
+        return dest
+
+    with storage.open(name, 'rb') as f:
+        return storage.save(dest, File(f, name=os.path.basename(dest)))
@@ -0,0 +1,15 @@
+from django import template
+
+from core.thumbnails import thumbnail_url
+
+register = template.Library()
+
+@register.filter(name='thumbnail')
+def thumbnail(file_field, size='s'):
+    """
+    URL of a small WebP preview of a FileField / ImageField value.
+    Usage: {{ offer.image|thumbnail:'l' }}
+    """
+    if not file_field:
+        return ''
+    return thumbnail_url(file_field.name, size)
@@ -1,3 +1,934 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+from io import BytesIO, StringIO
+from unittest import mock
+from pathlib import Path
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db.models import Sum
+from django.template import engines
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from . import analysis, pricing, versioning
+from .cart import CART_COUNT_SESSION_KEY, get_cart_count
+from .models import CartItem, Coupon, Order, PricingConfig, PublicHoliday, StoredDocument, UserProfile
+from .pricing import (
+    DEALER, PRICING_VERSION_KEY, QuoteError, get_checkout_totals, get_pricing_bundle, get_quote, get_rate_table,
+    price_order, sum_order_prices, tier_for_user,
+)
+from .storage import is_sharded
+from .thumbnails import thumbnail_url
+from .uploads import UploadError, persist_upload, read_upload_token
+from .utils import (
+    bulk_delivery_dates, calculate_delivery_date, canonical_page_ranges, count_color_pages, get_delivery_date_table,
+    parse_page_ranges,
+)
+from .views import process_successful_order
+
+SERVICES = ['Printing', 'Spiral Binding', 'Soft Binding', 'Custom Printing']
+PRINT_MODES = ['bw', 'color', 'custom_split', '1/4', '1/8', '1/9']
+
+
+def make_synthetic_orders(user, count, seed=7):
+    """Random mix of every service, print mode, side, layout and spiral tier."""
+    rng = random.Random(seed)
+    orders = []
+    for i in range(count):
+        service = rng.choice(SERVICES)
+        mode = rng.choice(PRINT_MODES)
+        pages = rng.choice([1, 2, 7, 40, 41, 60, 61, 90, 91, 110, 111, 150, 333])
+        colour = ''
+        if mode == 'custom_split':
+            mode = 'Custom Split (1-3)'
+            colour = rng.choice(['1-3', '2,4,6-9', '1-500', '5,5,5', 'x,2-1,3'])
+        orders.append(Order(
+            user=user, transaction_id=f"TXN_SYN{i:05d}", service_name=service,
+            print_mode=mode, side_type=rng.choice(['single', 'double']),
+            pages=pages, copies=rng.randint(1, 4), custom_color_pages=colour,
+            location='Main Campus', total_price=0, payment_status='Success',
+        ))
+    return Order.objects.bulk_create(orders)
+
+
+class DealerRevenueParityTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='9000000001', password='x')
+        config = PricingConfig.get_config()
+        config.dealer_price_per_page = '1.30'
+        config.spiral_extra_price_dealer = '7.50'
+        config.save()
+
+    def test_sql_aggregate_matches_python_pricing(self):
+        make_synthetic_orders(self.user, 600)
+        orders = Order.objects.filter(payment_status='Success')
+        rates = get_rate_table(DEALER)
+
+        expected = sum(price_order(o, rates=rates) for o in orders)
+        self.assertAlmostEqual(sum_order_prices(orders, DEALER), expected, places=6)
+
+    def test_filtered_and_empty_querysets(self):
+        make_synthetic_orders(self.user, 120, seed=11)
+        spiral = Order.objects.filter(service_name__icontains='Spiral')
+        expected = sum(price_order(o, DEALER) for o in spiral)
+        self.assertAlmostEqual(sum_order_prices(spiral, DEALER), expected, places=6)
+        self.assertEqual(sum_order_prices(Order.objects.none(), DEALER), 0.0)
+
+    def test_backfill_materialises_dealer_amounts(self):
+        make_synthetic_orders(self.user, 200, seed=3)
+        call_command('backfill_order_pricing', batch_size=64, stdout=StringIO())
+
+        orders = Order.objects.filter(payment_status='Success')
+        self.assertFalse(orders.filter(dealer_amount__isnull=True).exists())
+        for order in orders:
+            self.assertAlmostEqual(float(order.dealer_amount), price_order(order, DEALER), places=2)
+        stored = float(orders.aggregate(total=Sum('dealer_amount'))['total'])
+        self.assertAlmostEqual(stored, sum_order_prices(orders, DEALER), delta=0.005 * orders.count())
+
+
+NODE_PAGE_RANGES = """
+const PR = require(process.argv[1]);
+const cases = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+process.stdout.write(JSON.stringify(cases.map(([text, total]) => {
+    const intervals = PR.parsePageRanges(text);
+    const clipped = PR.clipPageRanges(intervals, total);
+    return [intervals, PR.formatPageRanges(clipped), PR.countPages(clipped)];
+})));
+"""
+
+
+class PageRangeTests(TestCase):
+    def test_intervals_are_merged_and_counted(self):
+        self.assertEqual(parse_page_ranges(" 7-5, 1,3,2,,x,4-"), [(1, 3), (5, 7)])
+        self.assertEqual(count_color_pages("1,3,5-7", 10), 5)
+        self.assertEqual(count_color_pages("1-10,15", 20), 11)
+        self.assertEqual(count_color_pages("", 10), 0)
+        self.assertEqual(count_color_pages("1-200000", 150000), 150000)
+        self.assertEqual(canonical_page_ranges("5-7,1, 3, 6,4", 6), "1,3-6")
+
+    @unittest.skipUnless(shutil.which('node'), "node is required to run the browser parser")
+    def test_browser_and_server_parsers_agree(self):
+        rng = random.Random(2024)
+        alphabet = "0123456789" * 3 + "--,,, \tab"
+        cases = [
+            ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40))), rng.randint(0, 500)]
+            for _ in range(3000)
+        ]
+        script = str(settings.BASE_DIR / 'static' / 'js' / 'page_ranges.js')
+        result = subprocess.run(
+            ['node', '-e', NODE_PAGE_RANGES, script],
+            input=json.dumps(cases), capture_output=True, text=True, check=True,
+        )
+        for (text, total), (intervals, canonical, count) in zip(cases, json.loads(result.stdout)):
+            with self.subTest(text=text, total=total):
+                self.assertEqual([tuple(iv) for iv in intervals], parse_page_ranges(text))
+                self.assertEqual(canonical, canonical_page_ranges(text, total))
+                self.assertEqual(count, count_color_pages(text, total))
+
+
+
+NODE_FINAL_PRICE = """
+const PageRanges = require(process.argv[1]);
+const window = {};
+const cases = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+let state = {}, out = {}, T = 0, currentService = '';
+const $ = (sel) => ({
+    val: (v) => v === undefined ? state[sel] : (state[sel] = v),
+    text: (v) => { out[sel] = v; },
+});
+const alert = () => { out.alert = true; };
+const requestQuote = () => {};
+%s
+process.stdout.write(JSON.stringify(cases.map((c) => {
+    state = {'#side_type': c.side_type, '#print_type': c.print_mode, '#copies': String(c.copies),
+             '#custom_color_input': c.custom_color_pages, '#layout_type': c.layout_type};
+    out = {}; T = c.pages; currentService = c.service_name;
+    calculateFinalPrice();
+    return out.alert ? null : [parseFloat(out['#price-display']), state['#total_price_hidden']];
+})));
+"""
+
+
+class PriceQuoteTests(TestCase):
+    def test_quote_endpoint_prices_on_the_users_tier(self):
+        params = {'service_name': 'Spiral Binding', 'print_mode': 'bw', 'side_type': 'single',
+                  'pages': 45, 'copies': 2}
+        res = self.client.get('/api/quote/', params).json()
+        self.assertTrue(res['success'])
+        # 45 B&W pages at 1.50 plus the second spiral tier, per copy
+        self.assertEqual(res['total'], round((45 * 1.5 + get_rate_table()['spiral_tier2_price']) * 2, 2))
+        self.assertEqual(res['payable'], int(res['total'] + 0.5))
+
+        dealer = User.objects.create_user(username='9000000101', password='x')
+        UserProfile.objects.update_or_create(user=dealer, defaults={'is_dealer': True})
+        self.client.force_login(dealer)
+        self.assertLess(self.client.get('/api/quote/', params).json()['total'], res['total'])
+
+        params['custom_color_pages'], params['print_mode'] = '50', 'custom_split'
+        self.assertIn('exceeds', self.client.get('/api/quote/', params).json()['error'])
+        self.assertFalse(self.client.get('/api/quote/', {'service_name': 'Laminating'}).json()['success'])
+
+    @unittest.skipUnless(shutil.which('node'), "node is required to run the services page script")
+    def test_services_page_estimate_matches_quote(self):
+        page = (settings.BASE_DIR / 'templates' / 'core' / 'services.html').read_text()
+        constants = page[page.index('    const P = window.FASTCOPY_PRICING;'):page.index('    // NOTE: Color prices')]
+        start = page.index('    function calculateFinalPrice() {')
+        function = page[start:page.index('        requestQuote();\n    }', start) + len('        requestQuote();\n    }')]
+        program = NODE_FINAL_PRICE % (get_pricing_bundle()[1] + constants + function)
+
+        rng = random.Random(11)
+        cases = [{
+            'service_name': rng.choice(SERVICES), 'print_mode': rng.choice(['bw', 'color', 'custom_split']),
+            'side_type': rng.choice(['single', 'double']), 'layout_type': rng.choice(['1/4', '1/8', '1/9']),
+            'pages': rng.choice([1, 2, 3, 7, 40, 41, 61, 91, 111, 150, 333]), 'copies': rng.randint(1, 4),
+            'custom_color_pages': rng.choice(['', '1', '1-3', '2,4,6-9', '5,5,5', 'x,2-1,3', '200']),
+        } for _ in range(400)]
+        script = str(settings.BASE_DIR / 'static' / 'js' / 'page_ranges.js')
+        result = subprocess.run(['node', '-e', program, script],
+                                input=json.dumps(cases), capture_output=True, text=True, check=True)
+        for case, estimate in zip(cases, json.loads(result.stdout)):
+            with self.subTest(**case):
+                if estimate is None:  # the page rejects the colour range, so must the server
+                    with self.assertRaises(QuoteError):
+                        get_quote(case)
+                    continue
+                quote = get_quote(case)
+                self.assertAlmostEqual(estimate[0], quote['total'], places=2)
+                self.assertEqual(estimate[1], quote['payable'])
+
+
+class PricingBenchmarkTests(TestCase):
+    def test_regression_against_baseline_fails_loudly(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = Path(tmp) / 'baseline.json'
+            opts = dict(orders=200, repeat=1, alloc_sample=20, baseline=str(baseline), stdout=StringIO())
+            call_command('bench_pricing', save_baseline=True, **opts)
+            data = json.loads(baseline.read_text())
+            self.assertEqual(set(data['paths']), {
+                'get_user_pricing', 'dealer_dashboard', 'calculate_dealer_price_for_order', 'count_color_pages',
+            })
+
+            # Pretend the recorded baseline was 10x faster
+            for path in data['paths'].values():
+                path['relative'] *= 10
+            baseline.write_text(json.dumps(data))
+            with self.assertRaisesMessage(CommandError, "slower than baseline"):
+                call_command('bench_pricing', **opts)
+
+
+
+class PricingVersionTests(TestCase):
+    class FailIfHeld:
+        """Stands in for pricing._lock; re-entering it would have deadlocked."""
+        def __init__(self):
+            self.held = False
+
+        def __enter__(self):
+            if self.held:
+                raise AssertionError("pricing lock re-entered")
+            self.held = True
+
+        def __exit__(self, *exc):
+            self.held = False
+
+    def setUp(self):
+        versioning._seen.clear()
+        self.addCleanup(versioning._seen.clear)  # the rolled-back token is re-read, so test prices don't leak
+
+    def test_empty_table_creates_config_without_deadlock(self):
+        PricingConfig.objects.all().delete()
+        pricing.bump_pricing_version()
+        with mock.patch.object(pricing, '_lock', self.FailIfHeld()):
+            self.assertEqual(get_rate_table()['price_per_page'], 1.5)
+        self.assertEqual(PricingConfig.objects.count(), 1)
+
+    def test_bump_from_another_worker_is_seen(self):
+        get_rate_table()  # first call may create the row, which bumps once
+        self.assertEqual(get_rate_table()['price_per_page'], 1.5)
+        with self.assertNumQueries(0):
+            get_rate_table()
+
+        # Another worker saved a new price: the row changed and the shared token moved,
+        # but this process's memo was not touched.
+        PricingConfig.objects.filter(pk=1).update(admin_price_per_page=2)
+        cache.set(PRICING_VERSION_KEY, 'bumped-elsewhere', None)
+        self.assertEqual(get_rate_table()['price_per_page'], 1.5)  # within VERSION_CHECK_INTERVAL
+        with mock.patch.object(versioning, 'VERSION_CHECK_INTERVAL', 0):
+            self.assertEqual(get_rate_table()['price_per_page'], 2.0)
+
+        # A save in this process is visible at once
+        config = PricingConfig.get_config()
+        config.admin_price_per_page = 3
+        config.save()
+        self.assertEqual(get_rate_table()['price_per_page'], 3.0)
+
+
+    def test_pricing_bundle_is_content_addressed(self):
+        digest, source = get_pricing_bundle()
+        url = f'/pricing/{digest}.js'
+        res = self.client.get(url)
+        self.assertEqual((res.status_code, res.content.decode()), (200, source))
+        self.assertIn('immutable', res['Cache-Control'])
+        self.assertIn('max-age=31536000', res['Cache-Control'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag']).status_code, 304)
+
+        # A price change moves the bundle; the old URL redirects and that redirect is never cached
+        config = PricingConfig.get_config()
+        config.admin_price_per_page = 2
+        config.save()
+        new_digest, new_source = get_pricing_bundle()
+        self.assertNotEqual(new_digest, digest)
+        self.assertIn('"price_bw": 2.0', new_source)
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertRedirects(res, f'/pricing/{new_digest}.js', fetch_redirect_response=False)
+        self.assertIn('no-cache', res['Cache-Control'])
+
+
+class HolidayIndexTests(TestCase):
+    def test_delivery_walk_uses_index_and_sees_changes(self):
+        monday_noon = timezone.make_aware(datetime.datetime(2026, 3, 2, 12, 0))
+        tuesday, wednesday = datetime.date(2026, 3, 3), datetime.date(2026, 3, 4)
+        self.assertEqual(calculate_delivery_date(monday_noon), tuesday)
+
+        with self.assertNumQueries(0):
+            for _ in range(20):
+                calculate_delivery_date(monday_noon)
+
+        holiday = PublicHoliday.objects.create(date=tuesday, name="Test Holiday")
+        self.assertEqual(calculate_delivery_date(monday_noon), wednesday)
+
+        holiday.delete()
+        self.assertEqual(calculate_delivery_date(monday_noon), tuesday)
+
+        PublicHoliday.objects.create(date=tuesday, name="Again")
+        self.assertEqual(calculate_delivery_date(monday_noon), wednesday)
+        PublicHoliday.objects.all().delete()
+        self.assertEqual(calculate_delivery_date(monday_noon), tuesday)
+
+
+    def test_delivery_table_matches_walk(self):
+        start = datetime.date(2026, 3, 2)
+        PublicHoliday.objects.create(date=datetime.date(2026, 3, 4), name="Midweek")
+        for _ in range(2):
+            table = get_delivery_date_table(start)
+            for day, (early, late) in table.items():
+                noon = timezone.make_aware(datetime.datetime.combine(day, datetime.time(12)))
+                with self.subTest(day=day):
+                    self.assertEqual(early, calculate_delivery_date(noon))
+                    self.assertEqual(late, calculate_delivery_date(noon.replace(hour=20)))
+            # Table is rebuilt once the holiday set changes
+            PublicHoliday.objects.get_or_create(date=datetime.date(2026, 3, 7), name="Saturday")
+        self.assertEqual(table[start], (datetime.date(2026, 3, 3), datetime.date(2026, 3, 5)))
+        self.assertEqual(table[datetime.date(2026, 3, 6)][1], datetime.date(2026, 3, 10))
+
+
+    def test_bulk_delivery_dates_and_backfill(self):
+        for day in (3, 4, 14, 30):
+            PublicHoliday.objects.create(date=datetime.date(2026, 3, day), name=f"H{day}")
+        rng = random.Random(3)
+        start = timezone.make_aware(datetime.datetime(2026, 2, 25))
+        times = [start + datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 40)) for _ in range(500)]
+        self.assertEqual(bulk_delivery_dates(times), [calculate_delivery_date(t) for t in times])
+
+        user = User.objects.create_user(username='9000000002', password='x')
+        make_synthetic_orders(user, 50)
+        for order, created in zip(Order.objects.order_by('id'), times):
+            Order.objects.filter(pk=order.pk).update(created_at=created, estimated_delivery_date=None)
+        call_command('backfill_delivery_dates', batch_size=7, stdout=StringIO())
+        for order in Order.objects.all():
+            self.assertEqual(order.estimated_delivery_date, calculate_delivery_date(order.created_at))
+
+
+
+class LazySiteContextTests(TestCase):
+    def test_context_values_only_query_when_read(self):
+        cache.clear()
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_user(username='9000000003', password='x')
+        request.session = {}
+        engine = engines['django']
+
+        with self.assertNumQueries(0):
+            engine.from_string("plain page").render({}, request)
+
+        get_delivery_date_table()  # warm the process-level table; its cost is covered by HolidayIndexTests
+        page = engine.from_string("{{ cart_item_count }}|{{ marquee_date_early|date:'Y-m-d' }}|{{ upcoming_holidays|length }}")
+        with self.assertNumQueries(2):
+            first = page.render({}, request)
+            # Nested / repeated renders on the same request reuse the values
+            self.assertEqual(page.render({}, request), first)
+        self.assertTrue(first.startswith("0|"))
+
+
+
+class CartCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='9000000004', password='x')
+        self.items = [
+            CartItem.objects.create(user=self.user, service_name='Printing', total_price=10, document_name=f"doc{i}.pdf")
+            for i in range(3)
+        ]
+        self.client.force_login(self.user)
+
+    def badge(self):
+        request = RequestFactory().get('/')
+        request.user, request.session = self.user, self.client.session
+        request.session.keys()  # loaded with the request, as in SessionMiddleware + auth
+        return request
+
+    def test_count_lives_in_session_and_is_adjusted_by_views(self):
+        request = self.badge()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_cart_count(request), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cart_count(request), 3)
+
+        # Seed the session the browser uses, then let a view adjust it
+        session = self.client.session
+        session[CART_COUNT_SESSION_KEY] = [3, time.time()]
+        session.save()
+        self.client.get(f'/cart/remove/{self.items[0].id}/')
+        request = self.badge()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cart_count(request), 2)
+
+        # A stale count falls back to the database
+        session = self.client.session
+        session[CART_COUNT_SESSION_KEY] = [7, time.time() - 3600]
+        session.save()
+        self.assertEqual(get_cart_count(self.badge()), 2)
+
+
+class CheckoutTotalsTests(TestCase):
+    def setUp(self):
+        versioning._seen.clear()
+        get_rate_table()  # creates the PricingConfig row up front, so its version bump can't void the memo
+        self.user = User.objects.create_user(username='9000000011', password='x')
+        now = timezone.now()
+        Coupon.objects.create(code='SAVE10', discount_percentage=10, max_usage_count=1,
+                              valid_from=now - datetime.timedelta(days=1), valid_until=now + datetime.timedelta(days=1))
+        self.items = [{'service_name': 'Printing', 'total_price': 90, 'pages': 60, 'copies': 1, 'location': 'Main Campus',
+                       'print_mode': 'bw', 'side_type': 'single'}]
+        self.client.force_login(self.user)
+        session = self.client.session
+        session.update({'cart': self.items, 'pending_batch_id': 'TXN_COUPON', 'applied_coupon_code': 'SAVE10'})
+        session.save()
+
+    def request(self):
+        request = RequestFactory().get('/checkout/summary/')
+        request.user, request.session = self.user, self.client.session
+        tier_for_user(request.user)  # profile lookup, as the first view access would
+        return request
+
+    def test_totals_are_memoised_until_cart_or_coupon_changes(self):
+        request = self.request()
+        totals = get_checkout_totals(request, self.items)
+        self.assertTrue(totals['coupon_valid'])
+        self.assertAlmostEqual(totals['grand_total'], totals['original_total'] * 0.9)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_checkout_totals(request, self.items), totals)
+
+        more = self.items + [{**self.items[0], 'total_price': 30}]
+        with self.assertNumQueries(1):  # re-reads the coupon
+            self.assertAlmostEqual(get_checkout_totals(request, more)['items_total'], 120)
+        with self.assertNumQueries(1):
+            self.assertFalse(get_checkout_totals(request, more, 'NOPE')['coupon_exists'])
+
+    def test_payment_rechecks_a_memoised_coupon(self):
+        self.assertContains(self.client.get('/checkout/summary/'), 'SAVE10')
+        # Another customer used up the coupon after this checkout was memoised
+        Coupon.objects.filter(code='SAVE10').update(current_usage_count=1)
+
+        self.assertRedirects(self.client.get('/payment/initiate/'), '/checkout/summary/', fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.assertNotIn('applied_coupon_code', self.client.session)
+        self.assertEqual(Coupon.objects.get(code='SAVE10').current_usage_count, 1)
+
+
+class DocumentUploadTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_upload_is_streamed_sniffed_and_hashed(self):
+        body = b'%PDF-1.4\n' + b'x' * (1024 * 1024)
+        upload = persist_upload(SimpleUploadedFile('notes.pdf', body), 'temp/')
+        self.assertEqual(upload['kind'], 'pdf')
+        self.assertEqual(upload['size'], len(body))
+        self.assertEqual(upload['sha256'], hashlib.sha256(body).hexdigest())
+        with default_storage.open(upload['path']) as f:
+            self.assertEqual(f.read(), body)
+
+        png = persist_upload(SimpleUploadedFile('scan.pdf', b'\x89PNG\r\n\x1a\n' + b'\0' * 64))
+        self.assertEqual(png['kind'], 'image')
+
+    def test_rejected_uploads_leave_nothing_behind(self):
+        with self.assertRaisesMessage(UploadError, "Only PDF and image files"):
+            persist_upload(SimpleUploadedFile('evil.pdf', b'MZ\x90\x00 not a pdf'))
+
+        # The declared size can understate the stream; the limit is enforced per chunk too
+        upload = SimpleUploadedFile('big.pdf', b'%PDF-' + b'x' * (3 * 1024 * 1024))
+        upload.size = 10
+        with override_settings(MAX_UPLOAD_SIZE=1024 * 1024):
+            with self.assertRaisesMessage(UploadError, "too large"):
+                persist_upload(upload)
+        self.assertEqual(list(Path(self.media.name).rglob('*.pdf')), [])
+
+    def test_bad_uploads_are_dropped_while_the_body_arrives(self):
+        from django.core.files.uploadhandler import TemporaryFileUploadHandler
+        from django.test import Client
+
+        self.client.force_login(User.objects.create_user(username='9000000012', password='x'))
+        spooled = []
+        spool = TemporaryFileUploadHandler.receive_data_chunk
+
+        def counting(handler, raw_data, start):
+            spooled.append(len(raw_data))
+            return spool(handler, raw_data, start)
+
+        big = SimpleUploadedFile('big.pdf', b'%PDF-' + b'x' * (8 * 1024 * 1024))
+        with override_settings(MAX_UPLOAD_SIZE=1024 * 1024, FILE_UPLOAD_MAX_MEMORY_SIZE=0), \
+                mock.patch.object(TemporaryFileUploadHandler, 'receive_data_chunk', counting):
+            res = self.client.post('/calculate-pages/', {'document': big}).json()
+        self.assertIn("too large", res['error'])
+        self.assertLessEqual(sum(spooled), 1024 * 1024)
+
+        evil = SimpleUploadedFile('evil.pdf', b'MZ\x90\x00' + b'\0' * 1024)
+        form = {'document': evil, 'service_name': 'Printing', 'print_mode': 'bw', 'copies': 1, 'location': 'Main Campus'}
+        self.assertIn("Only PDF and image files", self.client.post('/cart/add/', form).json()['error'])
+        self.assertEqual(list(Path(self.media.name).rglob('*')), [])
+
+        # The handlers are installed ahead of the CSRF check, which still applies
+        strict = Client(enforce_csrf_checks=True)
+        strict.force_login(User.objects.get(username='9000000012'))
+        self.assertEqual(strict.post('/calculate-pages/', {'document': SimpleUploadedFile('a.pdf', b'%PDF-1.4')}).status_code, 403)
+
+
+    def test_calculate_pages_token_replaces_second_upload(self):
+        user = User.objects.create_user(username='9000000005', password='x')
+        self.client.force_login(user)
+        pdf = (settings.BASE_DIR / 'orders' / 'Unit-3_Elementary_Combinatorics_Questions.pdf').read_bytes()
+
+        res = self.client.post('/calculate-pages/', {'document': SimpleUploadedFile('unit3.pdf', pdf)}).json()
+        self.assertTrue(res['success'])
+        pages = res['pages']
+
+        # No file on the second request, and the posted page count is ignored in favour of the token's
+        form = {'service_name': 'Printing', 'print_mode': 'bw', 'side_type': 'single', 'copies': 1,
+                'pages': 1, 'page_count': 1, 'location': 'Main Campus', 'upload_token': res['upload_token']}
+        self.assertTrue(self.client.post('/cart/add/', form).json()['success'])
+        item = CartItem.objects.get(user=user)
+        self.assertEqual((item.pages, item.document_name), (pages, 'unit3.pdf'))
+        self.assertEqual(float(item.total_price), round(pages * 1.5))
+        self.assertTrue(default_storage.exists(item.temp_path))
+
+        # The item's file is a hard link to the token's, not a copy
+        original = default_storage.path(read_upload_token(res['upload_token'])['path'])
+        self.assertTrue(os.path.samefile(original, default_storage.path(item.temp_path)))
+
+        # Without a token the file is counted on the server as well
+        del form['upload_token']
+        form['document'] = SimpleUploadedFile('unit3.pdf', pdf)
+        self.assertTrue(self.client.post('/cart/add/', form).json()['success'])
+        self.assertEqual(CartItem.objects.filter(user=user, pages=pages).count(), 2)
+        form['upload_token'] = res['upload_token']
+
+        form['upload_token'] = res['upload_token'][:-2] + 'xx'
+        del form['document']
+        self.assertIn('expired', self.client.post('/cart/add/', form).json()['error'])
+
+    def test_cart_stores_the_options_that_were_priced(self):
+        user = User.objects.create_user(username='9000000013', password='x')
+        self.client.force_login(user)
+        pdf = (settings.BASE_DIR / 'orders' / 'Unit-3_Elementary_Combinatorics_Questions.pdf').read_bytes()
+        token = self.client.post('/calculate-pages/', {'document': SimpleUploadedFile('unit3.pdf', pdf)}).json()['upload_token']
+
+        # custom_split is always quoted single-sided; a Custom Printing layout is what price_order() reads
+        forms = [
+            {'service_name': 'Printing', 'print_mode': 'custom_split', 'side_type': 'double', 'custom_color_pages': '1, 1-1'},
+            {'service_name': 'Custom Printing', 'print_mode': 'bw', 'layout_type': '1/8', 'side_type': 'single'},
+        ]
+        for form in forms:
+            form.update(copies=2, location='Main Campus', upload_token=token)
+            self.assertTrue(self.client.post('/cart/add/', form).json()['success'])
+
+        split, custom = CartItem.objects.filter(user=user).order_by('id')
+        self.assertEqual((split.print_mode, split.side_type, split.custom_color_pages), ('custom_split', 'single', '1'))
+        self.assertEqual(custom.print_mode, '1/8')
+        for item in (split, custom):
+            self.assertEqual(float(item.total_price), int(price_order(item, tier_for_user(user)) + 0.5))
+
+    def test_direct_order_upload_is_sharded_under_temp_direct(self):
+        self.client.force_login(User.objects.create_user(username='9000000014', password='x'))
+        form = {'service_name': 'Printing', 'print_mode': 'bw', 'copies': 1, 'location': 'Main Campus',
+                'document': SimpleUploadedFile('scan.png', b'\x89PNG\r\n\x1a\n' + b'\0' * 64)}
+        self.assertTrue(self.client.post('/order/direct/', form).json()['success'])
+        path = self.client.session['direct_item']['temp_image_path']
+        self.assertTrue(path.startswith('temp/direct/') and is_sharded(path))
+
+
+    def test_known_digest_skips_upload_and_parse(self):
+        cache.clear()
+        pdf = (settings.BASE_DIR / 'orders' / 'UHV_Unit_3.pdf').read_bytes()
+        digest = hashlib.sha256(pdf).hexdigest()
+        self.assertEqual(self.client.post('/upload/check/', {'sha256': digest}).status_code, 401)
+        user = User.objects.create_user(username='9000000007', password='x')
+        self.client.force_login(user)
+        self.assertFalse(self.client.post('/upload/check/', {'sha256': digest}).json()['known'])
+
+        first = self.client.post('/calculate-pages/', {'document': SimpleUploadedFile('UHV_Unit_3.pdf', pdf)}).json()
+        hit = self.client.post('/upload/check/', {'sha256': digest, 'name': '../copy.pdf'}).json()
+        self.assertTrue(hit['known'])
+        self.assertEqual(hit['pages'], first['pages'])
+
+        self.assertEqual(read_upload_token(hit['upload_token'])['name'], 'copy.pdf')
+
+        # Only the uploader's digests are answered; everyone else sends the bytes
+        other = User.objects.create_user(username='9000000015', password='x')
+        self.client.force_login(other)
+        self.assertFalse(self.client.post('/upload/check/', {'sha256': digest}).json()['known'])
+        self.client.force_login(user)
+
+        # Every use of a token gets its own temp file with identical bytes
+        form = {'service_name': 'Printing', 'print_mode': 'bw', 'side_type': 'single', 'copies': 1,
+                'location': 'Main Campus', 'upload_token': hit['upload_token']}
+        for _ in range(2):
+            self.assertTrue(self.client.post('/cart/add/', form).json()['success'])
+        paths = {item.temp_path for item in CartItem.objects.filter(user=user)}
+        self.assertEqual(len(paths), 2)
+        self.assertNotIn(read_upload_token(first['upload_token'])['path'], paths)
+        for path in paths:
+            with default_storage.open(path) as f:
+                self.assertEqual(hashlib.sha256(f.read()).hexdigest(), digest)
+
+        # Once an order holds the document, its blob answers for the digest, even when the
+        # temp files and the registry entry are gone
+        item = CartItem.objects.filter(user=user).first()
+        Order.objects.create(user=user, transaction_id='TXN_KNOWN', service_name='Printing', total_price=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            process_successful_order(user, [{
+                'service_name': 'Printing', 'total_price': 10, 'location': 'Main Campus', 'print_mode': 'bw',
+                'side_type': 'single', 'copies': 1, 'pages': item.pages, 'document_name': item.document_name,
+                'temp_path': item.temp_path, 'document_sha256': item.document_sha256,
+            }], 'TXN_KNOWN')
+        cache.clear()
+        for path in paths | {read_upload_token(first['upload_token'])['path']}:
+            default_storage.delete(path)
+        hit = self.client.post('/upload/check/', {'sha256': digest, 'name': 'again.pdf'}).json()
+        self.assertEqual((hit['known'], hit['pages']), (True, first['pages']))
+        form['upload_token'] = hit['upload_token']
+        self.assertTrue(self.client.post('/cart/add/', form).json()['success'])
+        self.assertEqual(StoredDocument.objects.get(sha256=digest).ref_count, 1)
+        self.client.force_login(other)
+        self.assertFalse(self.client.post('/upload/check/', {'sha256': digest}).json()['known'])
+
+
+    def test_identical_documents_share_one_reference_counted_blob(self):
+        user = User.objects.create_user(username='9000000006', password='x')
+        body = b'%PDF-1.4\n' + b'same bytes' * 100
+        items = []
+        for name in ('UHV_Unit_3.pdf', 'UHV_Unit_3 (1).pdf'):
+            upload = persist_upload(SimpleUploadedFile(name, body))
+            items.append({
+                'service_name': 'Printing', 'total_price': 10, 'location': 'Main Campus', 'print_mode': 'bw',
+                'side_type': 'single', 'copies': 1, 'pages': 1, 'document_name': name,
+                'temp_path': upload['path'], 'document_sha256': upload['sha256'] if name.endswith('3.pdf') else '',
+            })
+            Order.objects.create(user=user, transaction_id='TXN_SAME', service_name='Printing', total_price=10)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            process_successful_order(user, items, 'TXN_SAME')
+        doc = StoredDocument.objects.get()
+        self.assertEqual((doc.ref_count, doc.sha256), (2, hashlib.sha256(body).hexdigest()))
+        first, second = Order.objects.filter(transaction_id='TXN_SAME')
+        self.assertEqual({first.document.name, second.document.name}, {doc.file.name})
+        self.assertFalse(any(default_storage.exists(item['temp_path']) for item in items))
+
+        first.delete()
+        doc.refresh_from_db()
+        self.assertEqual(doc.ref_count, 1)
+        self.assertTrue(default_storage.exists(doc.file.name))
+
+        # Bulk deletes skip Order.delete(); gc_documents reconciles and collects
+        Order.objects.filter(pk=second.pk).delete()
+        call_command('gc_documents', stdout=StringIO())
+        self.assertFalse(StoredDocument.objects.exists())
+        self.assertFalse(default_storage.exists(doc.file.name))
+
+
+    def test_finalising_renames_instead_of_copying(self):
+        user = User.objects.create_user(username='9000000007', password='x')
+        upload = persist_upload(SimpleUploadedFile('big.pdf', b'%PDF-1.4\n' + b'y' * (2 * 1024 * 1024)))
+        inode = Path(default_storage.path(upload['path'])).stat().st_ino
+        item = {'service_name': 'Printing', 'total_price': 10, 'location': 'Main Campus', 'print_mode': 'bw',
+                'side_type': 'single', 'copies': 1, 'pages': 1, 'document_name': 'big.pdf',
+                'temp_path': upload['path'], 'document_sha256': upload['sha256']}
+        Order.objects.create(user=user, transaction_id='TXN_MOVE', service_name='Printing', total_price=10)
+
+        # A failure after the rename rolls the rows back and puts the file back for a retry
+        with mock.patch('core.views.materialize_order_pricing', side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                process_successful_order(user, [item], 'TXN_MOVE')
+        self.assertTrue(default_storage.exists(upload['path']))
+        self.assertFalse(StoredDocument.objects.exists())
+        self.assertEqual(list(Path(self.media.name, 'documents').rglob('*.pdf')), [])
+
+        # So does a failed rename itself
+        with mock.patch('core.documents.move', side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                process_successful_order(user, [item], 'TXN_MOVE')
+        self.assertTrue(default_storage.exists(upload['path']))
+        self.assertEqual(Order.objects.get().payment_status, 'Pending')
+
+        process_successful_order(user, [item], 'TXN_MOVE')
+        order = Order.objects.get()
+        self.assertEqual((order.payment_status, order.document.name), ('Success', StoredDocument.objects.get().file.name))
+        self.assertFalse(default_storage.exists(upload['path']))
+        self.assertEqual(Path(default_storage.path(order.document.name)).stat().st_ino, inode)
+
+
+    def test_janitor_deletes_only_old_unreferenced_temp_files(self):
+        user = User.objects.create_user(username='9000000008', password='x')
+        old = time.time() - 3 * 24 * 3600
+        paths = {}
+        for label in ('orphan', 'in_cart', 'fresh'):
+            paths[label] = persist_upload(SimpleUploadedFile(f'{label}.pdf', b'%PDF-1.4\n' + b'z' * 1000))['path']
+            if label != 'fresh':
+                os.utime(default_storage.path(paths[label]), (old, old))
+        CartItem.objects.create(user=user, service_name='Printing', total_price=1, document_name='in_cart.pdf', temp_path=paths['in_cart'])
+
+        out = StringIO()
+        call_command('clean_temp_uploads', '--dry-run', stdout=out)
+        self.assertIn('1 would be deleted', out.getvalue())
+        self.assertTrue(default_storage.exists(paths['orphan']))
+
+        out = StringIO()
+        call_command('clean_temp_uploads', stdout=out)
+        self.assertIn('1 referenced, 1 too young, 1 deleted', out.getvalue())
+        self.assertEqual([default_storage.exists(paths[k]) for k in ('orphan', 'in_cart', 'fresh')], [False, True, True])
+
+
+    def test_media_is_sharded_and_legacy_files_are_relocated(self):
+        user = User.objects.create_user(username='9000000009', password='x')
+        upload = persist_upload(SimpleUploadedFile('new.pdf', b'%PDF-1.4\n new'))
+        self.assertTrue(is_sharded(upload['path']) and upload['path'].startswith('temp/'))
+
+        # A flat blob and a flat pre-document-store order file, as left by older code
+        flat_blob = default_storage.save('documents/flatblob.pdf', BytesIO(b'%PDF-1.4\n blob'))
+        doc = StoredDocument.objects.create(sha256='ab' * 32, file=flat_blob, ref_count=1)
+        shared = Order.objects.create(user=user, service_name='Printing', total_price=1, document=flat_blob, stored_document=doc)
+        legacy_name = default_storage.save('orders/images/scan.png', BytesIO(b'\x89PNG\r\n\x1a\n'))
+        legacy = Order.objects.create(user=user, service_name='Printing', total_price=1, image_upload=legacy_name)
+
+        call_command('shard_media', '--dry-run', stdout=StringIO())
+        self.assertTrue(default_storage.exists(flat_blob))
+
+        out = StringIO()
+        call_command('shard_media', '--batch-size', '1', stdout=out)
+        self.assertIn('2 files moved, 3 paths rewritten', out.getvalue())
+        for obj in (doc, shared, legacy):
+            obj.refresh_from_db()
+        self.assertEqual(shared.document.name, doc.file.name)
+        self.assertRegex(doc.file.name, r'^documents/\d{4}/\d{2}/ab/ab/abab.*\.pdf$')
+        self.assertTrue(legacy.image_upload.name.startswith('orders/images/') and is_sharded(legacy.image_upload.name))
+        self.assertTrue(all(default_storage.exists(n) for n in (doc.file.name, legacy.image_upload.name)))
+        self.assertFalse(default_storage.exists(legacy_name))
+
+        # Idempotent
+        out = StringIO()
+        call_command('shard_media', stdout=out)
+        self.assertIn('0 files moved, 0 paths rewritten', out.getvalue())
+
+
+class PdfAnalysisPoolTests(TestCase):
+    def setUp(self):
+        self.addCleanup(analysis.shutdown)
+
+    def test_pages_are_counted_in_a_worker(self):
+        path = str(settings.BASE_DIR / 'orders' / 'UHV_Unit_3.pdf')
+        pages, error = analysis.run(analysis.count_pdf_pages, path)
+        self.assertIsNone(error)
+        self.assertEqual(pages, analysis.count_pdf_pages(path)[0])
+
+        self.assertEqual(analysis.run(analysis.count_pdf_pages, __file__), (None, 'Invalid PDF file'))
+
+    def test_every_upload_source_counts_the_same(self):
+        path = settings.BASE_DIR / 'orders' / 'UHV_Unit_3.pdf'
+        body = path.read_bytes()
+        spooled = TemporaryUploadedFile('spooled.pdf', 'application/pdf', len(body), None)
+        self.addCleanup(spooled.close)
+        spooled.write(body)
+        spooled.flush()
+        counts = {analysis.count_pdf_pages(source) for source in (
+            path, spooled, SimpleUploadedFile('memory.pdf', body), body)}
+        self.assertEqual(counts, {analysis.count_pdf_pages(str(path))})
+
+    def test_colour_pages_are_detected_and_prefilled(self):
+        import fitz
+
+        doc = fitz.open()
+        for number in range(1, 8):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Grey body text on page {number}", color=(0.3, 0.3, 0.3))
+            if number in (2, 3, 6):
+                page.draw_rect(fitz.Rect(100, 300, 160, 340), fill=(0.1, 0.4, 0.9))
+        body = doc.tobytes()
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.client.force_login(User.objects.create_user(username='9000000008', password='x'))
+        with override_settings(MEDIA_ROOT=media.name):
+            res = self.client.post('/calculate-pages/', {'document': SimpleUploadedFile('mixed.pdf', body)}).json()
+        self.assertEqual((res['pages'], res['color_pages'], res['color_page_count']), (7, '2-3,6', 3))
+
+        # Long documents are counted but not scanned; the field is simply left for the customer
+        with override_settings(MEDIA_ROOT=media.name), mock.patch.object(analysis, 'COLOR_SCAN_MAX_PAGES', 5), \
+                mock.patch.object(analysis, 'color_pages_in_range', side_effect=AssertionError("scanned")):
+            res = self.client.post('/calculate-pages/', {'document': SimpleUploadedFile('mixed.pdf', body)}).json()
+        self.assertEqual((res['success'], res['pages'], res['color_pages']), (True, 7, None))
+
+    def test_slow_job_times_out_and_pool_recovers(self):
+        started = time.monotonic()
+        with self.assertRaisesMessage(analysis.AnalysisError, "Timed out"):
+            analysis.run(time.sleep, 30, timeout=1)
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(analysis.run(abs, -3), 3)
+
+    def test_wedged_worker_does_not_kill_other_requests_jobs(self):
+        import signal
+        from concurrent.futures import ThreadPoolExecutor
+
+        analysis.run(abs, -1)  # workers spawned
+        with ThreadPoolExecutor(1) as other_request:
+            neighbour = other_request.submit(analysis.run, time.sleep, 4, timeout=8)
+            time.sleep(0.2)
+            # sigwait blocks in C, so the worker's own alarm never gets to run
+            with self.assertRaisesMessage(analysis.AnalysisError, "Timed out"):
+                analysis.run(signal.sigwait, [signal.SIGUSR1], timeout=1)
+            # New work goes to a fresh pool while the old one finishes the neighbour's job
+            self.assertEqual(analysis.run(abs, -3), 3)
+            self.assertIsNone(neighbour.result())
+
+    def test_full_pool_fails_fast_instead_of_queueing(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(settings.PDF_ANALYSIS_WORKERS) as others:
+            busy = [others.submit(analysis.run, time.sleep, 2) for _ in range(settings.PDF_ANALYSIS_WORKERS)]
+            time.sleep(0.2)
+            with self.assertRaisesMessage(analysis.AnalysisError, "busy"):
+                analysis.run_many(abs, [(-3,)], queue_wait=0.1)
+            self.assertEqual(analysis.run(abs, -3), 3)  # waits for a slot
+            for future in busy:
+                future.result()
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        self.addCleanup(analysis.shutdown)
+        self.dirs = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dirs.cleanup)
+        override = override_settings(MEDIA_ROOT=f"{self.dirs.name}/media", THUMBNAIL_CACHE_DIR=f"{self.dirs.name}/thumbs")
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_photo_is_served_as_small_cached_webp(self):
+        from PIL import Image
+
+        photo = BytesIO()
+        Image.new('RGB', (2400, 1800), (200, 40, 40)).save(photo, 'JPEG', quality=95)
+        name = default_storage.save('orders/images/photo.jpg', BytesIO(photo.getvalue()))
+        url = thumbnail_url(name)
+
+        res = self.client.get(url)
+        self.assertEqual((res.status_code, res['Content-Type']), (200, 'image/webp'))
+        body = b''.join(res.streaming_content)
+        self.assertLess(len(body), len(photo.getvalue()) // 20)
+        self.assertEqual(max(Image.open(BytesIO(body)).size), 96)
+
+        # Second hit is a file read, and a byte-identical copy shares the same preview
+        copy = default_storage.save('offers/same.jpg', BytesIO(photo.getvalue()))
+        with mock.patch.object(analysis, 'run', side_effect=AssertionError("re-rendered")):
+            self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(self.client.get(thumbnail_url(copy)).status_code, 200)
+
+        self.assertEqual(self.client.get(url[:-8] + 'xx.webp').status_code, 404)
+
+        # A new photo saved under the same name gets its own preview
+        default_storage.delete(name)
+        replacement = BytesIO()
+        Image.new('RGB', (1200, 1800), (40, 40, 200)).save(replacement, 'JPEG', quality=90)
+        self.assertEqual(default_storage.save(name, BytesIO(replacement.getvalue())), name)
+        res = self.client.get(url)
+        self.assertEqual(Image.open(BytesIO(b''.join(res.streaming_content))).size, (64, 96))
+
+    def test_uploaded_pdf_gets_first_page_preview(self):
+        pdf = (settings.BASE_DIR / 'orders' / 'UHV_Unit_3.pdf').read_bytes()
+        self.client.force_login(User.objects.create_user(username='9000000009', password='x'))
+        res = self.client.post('/calculate-pages/', {'document': SimpleUploadedFile('UHV_Unit_3.pdf', pdf)}).json()
+        preview = self.client.get(res['preview_url'])
+        self.assertEqual(preview['Content-Type'], 'image/webp')
+        self.assertNotIn('immutable', preview['Cache-Control'])
+
+        # The link stops working once the token is past THUMBNAIL_TOKEN_MAX_AGE
+        with override_settings(THUMBNAIL_TOKEN_MAX_AGE=-1):
+            self.assertEqual(self.client.get(res['preview_url']).status_code, 404)
+
+
+class DealerDownloadTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        dealer = User.objects.create_user(username='9000000010', password='x')
+        UserProfile.objects.create(user=dealer, mobile='9000000010', is_dealer=True)
+        self.client.force_login(dealer)
+        self.body = bytes(range(256)) * 40
+        name = default_storage.save('documents/order.pdf', BytesIO(self.body))
+        self.order = Order.objects.create(user=dealer, service_name='Printing', total_price=1, payment_status='Success', document=name)
+        self.url = f'/dealer/download/{self.order.id}/'
+
+    def test_full_conditional_and_partial_downloads(self):
+        full = self.client.get(self.url)
+        self.assertEqual(b''.join(full.streaming_content), self.body)
+        self.assertIn(f'filename="{self.order.order_id}.pdf"', full['Content-Disposition'])
+        self.assertEqual(full['Accept-Ranges'], 'bytes')
+        etag = full['ETag']
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        part = self.client.get(self.url, HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE=etag)
+        self.assertEqual((part.status_code, part['Content-Range']), (206, f'bytes 100-199/{len(self.body)}'))
+        self.assertEqual(b''.join(part.streaming_content), self.body[100:200])
+
+        tail = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(tail.streaming_content), self.body[-10:])
+
+        # A stale If-Range means the file changed: send all of it
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"').status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.body)}-').status_code, 416)
+
+    @override_settings(DOWNLOAD_OFFLOAD='x-accel-redirect', DOWNLOAD_ACCEL_PREFIX='/protected-media/')
+    def test_transfer_is_handed_to_the_proxy(self):
+        res = self.client.get(self.url)
+        self.assertEqual(res['X-Accel-Redirect'], f'/protected-media/{self.order.document.name}')
+        self.assertEqual(res.content, b'')
@@ -0,0 +1,93 @@
+"""
+Thumbnail / preview pipeline for FastCopy.
+
+Admin lists, the home page offer popup and the services page upload preview
+show small WebP renders instead of original photos or whole PDFs. A thumbnail
+URL carries a signed reference to the source file, so it cannot be used to
+read arbitrary storage paths, and expires after THUMBNAIL_TOKEN_MAX_AGE so a
+shared link does not expose a customer's document for good. The first request renders the preview in the
+analysis process pool (first page for PDFs) and keeps it on disk under the
+source's SHA-256, so identical files share previews and every later hit is a
+plain file read.
+"""
+import hashlib
+import os
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+from . import analysis
+from .documents import file_sha256
+from .uploads import SNIFF_BYTES, sniff_kind
+
+THUMBNAIL_SIZES = {'s': 96, 'm': 480, 'l': 1000}  # longest edge in px
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_TOKEN_SALT = 'core.thumbnails'
+THUMBNAIL_DIGEST_PREFIX = 'core:thumb:sha256'
+
+
+def thumbnail_url(name, size='s', sha256=None):
+    """
+    URL of a WebP preview for a stored file (no I/O here, rendering happens on first request).
+    Pass sha256 when it is already known to save hashing the source later.
+    """
+    if not name:
+        return ''
+    if size not in THUMBNAIL_SIZES:
+        raise ValueError(f"Unknown thumbnail size {size!r}")
+    token = signing.dumps([name, size, sha256], salt=THUMBNAIL_TOKEN_SALT, compress=True)
+    return reverse('thumbnail', args=[token])
+
+
+def source_digest(name):
+    """
+    SHA-256 of a stored file, cached under its name, size and modification time:
+    a file replaced under the same name (an offer image saved over the old one)
+    is hashed again instead of keeping its old preview.
+    """
+    try:
+        stamp = default_storage.get_modified_time(name).timestamp()
+    except NotImplementedError:
+        stamp = ''
+    source = f"{name}:{default_storage.size(name)}:{stamp}"
+    key = f"{THUMBNAIL_DIGEST_PREFIX}:{hashlib.sha1(source.encode()).hexdigest()}"
+    digest = cache.get(key)
+    if digest is None:
+        digest = file_sha256(name)
+        cache.set(key, digest, None)
+    return digest
+
+
+def cache_path(sha256, size):
+    """On-disk location of a rendered preview."""
+    return os.path.join(settings.THUMBNAIL_CACHE_DIR, sha256[:2], f"{sha256}-{size}.webp")
+
+
+def get_thumbnail(token):
+    """
+    Returns the path of the preview for a thumbnail token, rendering it if needed,
+    or None when the source is gone or is not a PDF / image.
+    Raises signing.BadSignature for forged or expired tokens and analysis.AnalysisError if rendering fails.
+    """
+    name, size, sha256 = signing.loads(token, salt=THUMBNAIL_TOKEN_SALT, max_age=settings.THUMBNAIL_TOKEN_MAX_AGE)
+    if sha256 is None:
+        if not default_storage.exists(name):
+            return None
+        sha256 = source_digest(name)
+
+    path = cache_path(sha256, size)
+    if os.path.exists(path):
+        return path
+    if not default_storage.exists(name):
+        return None
+
+    with default_storage.open(name, 'rb') as f:
+        kind = sniff_kind(f.read(SNIFF_BYTES))
+    if kind is None:
+        return None
+    with analysis.local_path(name) as source:
+        analysis.run(analysis.render_thumbnail, source, path, kind, THUMBNAIL_SIZES[size], THUMBNAIL_QUALITY)
+    return path
@@ -0,0 +1,373 @@
+"""
+Streaming upload persistence for FastCopy.
+
+Uploaded documents are copied to storage chunk by chunk instead of being read
+into one bytes object, so peak memory per upload stays at one chunk no matter
+how large the file is. While the chunks go through, the size limit is
+enforced and a SHA-256 digest is computed; the file type is sniffed from its
+magic bytes before anything is written.
+"""
+import hashlib
+import os
+import re
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+from .storage import link, shard_path
+
+UPLOAD_CHUNK_SIZE = 256 * 1024  # bytes
+
+PDF = 'pdf'
+IMAGE = 'image'
+
+# (prefix, kind) checked against the first bytes of the upload
+MAGIC_BYTES = (
+    (b'%PDF-', PDF),
+    (b'\xff\xd8\xff', IMAGE),                # JPEG
+    (b'\x89PNG\r\n\x1a\n', IMAGE),          # PNG
+    (b'GIF87a', IMAGE), (b'GIF89a', IMAGE),  # GIF
+)
+SNIFF_BYTES = 16
+
+UPLOAD_TOKEN_SALT = 'core.uploads.token'
+UPLOAD_TOKEN_MAX_AGE = 60 * 60 * 24  # seconds
+
+UPLOAD_DIGEST_PREFIX = 'core:upload:sha256'
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(ValueError):
+    """Raised for rejected uploads; the message is safe to show to the user."""
+
+
+def sniff_kind(header):
+    """Returns 'pdf' / 'image' from a file's leading bytes, or None if unsupported."""
+    for magic, kind in MAGIC_BYTES:
+        if header.startswith(magic):
+            return kind
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return IMAGE
+    return None
+
+
+def _size_error(limit):
+    return UploadError(f"File is too large (limit {limit // (1024 * 1024)} MB)")
+
+
+def _kind_error():
+    return UploadError("Only PDF and image files (JPEG, PNG, GIF, WebP) are accepted")
+
+
+class _HashingUpload(File):
+    """Hands chunks to the storage backend, size-checking and hashing each one."""
+
+    def __init__(self, uploaded_file, limit):
+        super().__init__(uploaded_file, name=uploaded_file.name)
+        self.limit = limit
+        self.bytes_seen = 0
+        self.sha256 = hashlib.sha256()
+
+    def chunks(self, chunk_size=None):
+        for chunk in self.file.chunks(chunk_size or UPLOAD_CHUNK_SIZE):
+            self.bytes_seen += len(chunk)
+            if self.bytes_seen > self.limit:
+                raise _size_error(self.limit)
+            self.sha256.update(chunk)
+            yield chunk
+
+
+def _temp_name(prefix, name):
+    """Unique, sharded storage name for a new upload: temp/YYYY/MM/ab/cd/<uuid>_<name>."""
+    key = uuid.uuid4().hex
+    return shard_path(prefix, key, f"{key}_{name}")
+
+
+def persist_upload(uploaded_file, prefix='temp/'):
+    """
+    Streams an UploadedFile into default_storage under `prefix`.
+    Returns {'path', 'name', 'kind', 'size', 'sha256'}; raises UploadError for
+    unsupported or oversized files (nothing is left behind in storage).
+    """
+    limit = settings.MAX_UPLOAD_SIZE
+    if uploaded_file.size and uploaded_file.size > limit:
+        raise _size_error(limit)
+
+    uploaded_file.seek(0)
+    kind = sniff_kind(uploaded_file.read(SNIFF_BYTES))
+    if kind is None:
+        raise _kind_error()
+    uploaded_file.seek(0)
+
+    content = _HashingUpload(uploaded_file, limit)
+    path = default_storage.generate_filename(_temp_name(prefix, uploaded_file.name))
+    try:
+        path = default_storage.save(path, content)
+    except UploadError:
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        raise
+
+    return {
+        'path': path,
+        'name': uploaded_file.name,
+        'kind': kind,
+        'size': content.bytes_seen,
+        'sha256': content.sha256.hexdigest(),
+    }
+
+
+# --- Checks while the body arrives ---
+# persist_upload only sees a file once Django has read the whole request body
+# into memory or a temp file. For the document views, UploadGuardHandler runs
+# ahead of Django's handlers and drops a file (SkipFile) as soon as it is over
+# the size limit or its first bytes are not a PDF / image, so the rest is never
+# spooled. The remaining form fields are still parsed, CSRF token included.
+
+class UploadGuardHandler(FileUploadHandler):
+    """Counts and sniffs each file's chunks as they arrive; the reason for a drop is left on request.upload_error."""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received, self.header = 0, b''
+        if self.content_length and self.content_length > settings.MAX_UPLOAD_SIZE:
+            self._reject(_size_error(settings.MAX_UPLOAD_SIZE))
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.MAX_UPLOAD_SIZE:
+            self._reject(_size_error(settings.MAX_UPLOAD_SIZE))
+        if len(self.header) < SNIFF_BYTES:
+            self.header += raw_data[:SNIFF_BYTES - len(self.header)]
+            if len(self.header) == SNIFF_BYTES and sniff_kind(self.header) is None:
+                self._reject(_kind_error())
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None  # the next handler builds the UploadedFile
+
+    def _reject(self, error):
+        if not getattr(self.request, 'upload_error', None):
+            self.request.upload_error = str(error)
+        raise SkipFile(str(error))
+
+
+def guard_uploads(view):
+    """
+    Runs UploadGuardHandler for a view's uploads. Upload handlers must be in
+    place before anything reads request.POST, and CSRF checking does, hence the
+    exempt / protect pair recommended by Django's upload handler docs.
+    """
+    protected = csrf_protect(view)
+
+    @wraps(view)
+    @csrf_exempt
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers.insert(0, UploadGuardHandler(request))
+        return protected(request, *args, **kwargs)
+    return wrapper
+
+
+def rejected_upload(request):
+    """Why UploadGuardHandler dropped a file from this request, or None."""
+    request.FILES  # parses the body, running the handlers, if nothing has yet
+    return getattr(request, 'upload_error', None)
+
+
+# --- Upload tokens ---
+# calculate_pages stores the file once and returns a signed token describing
+# it; the cart / direct-order endpoints accept the token instead of a second
+# copy of the file. The token is tamper-proof, so the page count in it is
+# trusted over anything the browser posts.
+
+def make_upload_token(upload):
+    """Signs an upload dict (as returned by persist_upload, plus 'pages')."""
+    return signing.dumps(upload, salt=UPLOAD_TOKEN_SALT, compress=True)
+
+
+def read_upload_token(token):
+    """Returns the upload dict for a token, or raises UploadError if it is invalid or expired."""
+    try:
+        upload = signing.loads(token, salt=UPLOAD_TOKEN_SALT, max_age=UPLOAD_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        raise UploadError("Your upload has expired, please upload the file again")
+    if not default_storage.exists(upload['path']):
+        raise UploadError("Your upload has expired, please upload the file again")
+    return upload
+
+
+# --- Known-document registry ---
+# The browser hashes a file (SubtleCrypto) and asks check_upload whether that
+# digest is already stored: either as a finalised document blob (StoredDocument,
+# kept as long as an order uses it) or as a recent upload registered here.
+# Digests are only recorded for files hashed on the server, so a hit always
+# refers to bytes with that exact SHA-256.
+# Both are scoped to the asking user: a digest only answers for documents that
+# user uploaded or ordered, so nobody can probe what others have printed or get
+# a token for their files. Anyone else sends the bytes.
+
+def _digest_key(sha256, user_id):
+    return f"{UPLOAD_DIGEST_PREFIX}:{user_id}:{sha256}"
+
+
+def remember_upload(upload, user):
+    """Registers a stored upload (with its page count) under its digest, for the user who sent it."""
+    cache.set(_digest_key(upload['sha256'], user.pk), upload, UPLOAD_TOKEN_MAX_AGE)
+
+
+def find_upload(sha256, user):
+    """Returns an upload dict for a digest the user uploaded or ordered whose bytes are still stored, else None."""
+    from .models import StoredDocument
+
+    sha256 = (sha256 or '').lower()
+    if not SHA256_RE.match(sha256):
+        return None
+    doc = StoredDocument.objects.filter(
+        sha256=sha256, ref_count__gt=0, pages__isnull=False, orders__user=user,
+    ).first()
+    if doc is not None and default_storage.exists(doc.file.name):
+        return {
+            'path': doc.file.name, 'name': os.path.basename(doc.file.name), 'kind': doc.kind,
+            'size': doc.size, 'sha256': sha256, 'pages': doc.pages,
+        }
+    upload = cache.get(_digest_key(sha256, user.pk))
+    if upload is None or not default_storage.exists(upload['path']):
+        return None
+    return upload
+
+
+def clone_upload(upload, name, prefix='temp/'):
+    """
+    New temp name for a known upload for a new cart item / order, so every
+    item owns its temp file and finalising one never removes another's.
+    The name is a hard link where storage allows (see storage.link), so no
+    bytes are copied, transferred from the browser or parsed again.
+    """
+    path = default_storage.generate_filename(_temp_name(prefix, name))
+    return {**upload, 'path': link(upload['path'], path), 'name': name}
+
+
+# --- Temp janitor ---
+# Abandoned direct orders (the item only lives in the session) and deleted
+# cart items leave their files in temp/. Anything there that is older than
+# TEMP_UPLOAD_MAX_AGE (well past UPLOAD_TOKEN_MAX_AGE) and that no CartItem
+# points at can no longer reach an order, and is deleted.
+
+TEMP_ROOT = 'temp'
+
+
+def _iter_stored_files(root):
+    """Yields (name, size, mtime) for every file under a storage directory, streaming it."""
+    try:
+        base = default_storage.path(root)
+    except NotImplementedError:
+        base = None
+
+    if base is not None:
+        stack = [base]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        name = os.path.relpath(entry.path, base).replace(os.sep, '/')
+                        yield f"{root}/{name}", stat.st_size, stat.st_mtime
+        return
+
+    # Remote storages: listdir per directory
+    dirs, files = default_storage.listdir(root)
+    for name in files:
+        name = f"{root}/{name}"
+        yield name, default_storage.size(name), default_storage.get_modified_time(name).timestamp()
+    for sub in dirs:
+        yield from _iter_stored_files(f"{root}/{sub}")
+
+
+def _referenced(names=None):
+    """Temp paths still used by cart items: all of them in one query, or only those among `names`."""
+    from django.db.models import Q
+    from .models import CartItem
+
+    items = CartItem.objects.all()
+    if names is not None:
+        items = items.filter(Q(temp_path__in=names) | Q(temp_image_path__in=names))
+    referenced = set()
+    for temp_path, temp_image_path in items.values_list('temp_path', 'temp_image_path').iterator():
+        referenced.update((temp_path, temp_image_path))
+    return referenced
+
+
+def clean_temp_uploads(max_age=None, batch_size=500, dry_run=False, on_batch=None):
+    """
+    Deletes orphaned temp/ uploads older than max_age seconds, batch_size at a time.
+    Each batch is re-checked against CartItem right before deleting, so a cart
+    item restored meanwhile (failed direct payment) keeps its file.
+    Returns counters: scanned, scanned_bytes, kept, young, deleted, reclaimed_bytes, batches.
+    """
+    max_age = settings.TEMP_UPLOAD_MAX_AGE if max_age is None else max_age
+    cutoff = time.time() - max_age
+    referenced = _referenced()
+    stats = dict.fromkeys(('scanned', 'scanned_bytes', 'kept', 'young', 'deleted', 'reclaimed_bytes', 'batches'), 0)
+
+    def flush(batch):
+        still_used = _referenced([name for name, _ in batch])
+        for name, size in batch:
+            if name in still_used:
+                stats['kept'] += 1
+                continue
+            if not dry_run:
+                default_storage.delete(name)
+            stats['deleted'] += 1
+            stats['reclaimed_bytes'] += size
+        stats['batches'] += 1
+        if on_batch:
+            on_batch(stats)
+
+    batch = []
+    for name, size, mtime in _iter_stored_files(TEMP_ROOT):
+        stats['scanned'] += 1
+        stats['scanned_bytes'] += size
+        if name in referenced:
+            stats['kept'] += 1
+        elif mtime > cutoff:
+            stats['young'] += 1
+        else:
+            batch.append((name, size))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+    if batch:
+        flush(batch)
+    if not dry_run:
+        _prune_empty_dirs(TEMP_ROOT, cutoff)
+    return stats
+
+
+def _prune_empty_dirs(root, cutoff):
+    """Removes shard directories left empty (and untouched since cutoff) on local storage."""
+    try:
+        base = default_storage.path(root)
+    except NotImplementedError:
+        return
+    for path, dirs, files in os.walk(base, topdown=False):
+        if path == base or files:
+            continue
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                os.rmdir(path)
+        except OSError:
+            pass  # not empty any more, or already gone
@@ -5,6 +5,7 @@ urlpatterns = [
     # --- 🏠 Home & Static ---
     path('', views.home, name='home'),
     path('services/', views.services_page, name='services'),
+    path('pricing/<str:digest>.js', views.pricing_bundle_js, name='pricing_bundle'),
     path('about/', views.about, name='about'),
     path('contact/', views.contact, name='contact'),
     path('privacy/', views.privacy_policy, name='privacy_policy'),
@@ -28,6 +29,9 @@ urlpatterns = [
     path('cart/add/', views.add_to_cart, name='add_to_cart'),
     path('cart/remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('calculate-pages/', views.calculate_pages, name='calculate_pages'),
+    path('upload/check/', views.check_upload, name='check_upload'),
+    path('thumbs/<str:token>.webp', views.thumbnail_image, name='thumbnail'),
+    path('api/quote/', views.price_quote, name='price_quote'),
 
     # --- 🚀 Checkout & Orders ---
     # order_now: Path for Service Page "Order Now" (Direct)
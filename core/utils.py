@@ -1,7 +1,14 @@
 import datetime
+import re
+from bisect import bisect_right
 from datetime import timedelta
 from django.utils import timezone
-from .models import PublicHoliday
+from .holidays import get_holiday_ordinals, holiday_version
+
+DELIVERY_CUTOFF_HOUR = 20  # 8 PM local time
+DELIVERY_TABLE_DAYS = 14
+
+_delivery_table = {'value': None}  # ((today, holiday version), table)
 
 def calculate_delivery_date(order_time=None):
     """
@@ -28,50 +35,175 @@ def calculate_delivery_date(order_time=None):
     # causing the check to fail. This fixes it.
     order_time = timezone.localtime(order_time)
     
-    # 1. Determine how many working days to add based on order time
-    current_hour = order_time.hour
-    current_weekday = order_time.weekday()  # 0=Monday, 5=Saturday, 6=Sunday
-    
+    return _delivery_date_for(order_time.date(), order_time.hour >= DELIVERY_CUTOFF_HOUR, get_holiday_ordinals())
+
+
+def _working_days_to_add(order_day, after_cutoff):
     # SATURDAY EXCEPTION: Orders placed on Saturday always get next working day (Monday)
     # regardless of time
-    if current_weekday == 5:  # Saturday
-        working_days_to_add = 1  # Next working day (Monday, skipping Sunday)
-    # AT or AFTER 8 PM check: hour >= 20
-    elif current_hour >= 20:
-        working_days_to_add = 2  # Day after next working day
-    else:
-        working_days_to_add = 1  # Next working day
-    
-    # 2. Start from tomorrow
-    delivery_date = order_time.date() + timedelta(days=1)
+    if order_day.weekday() == 5:  # Saturday
+        return 1  # Next working day (Monday, skipping Sunday)
+    # AT or AFTER 8 PM: Day after next working day
+    return 2 if after_cutoff else 1
+
+
+def _delivery_date_for(order_day, after_cutoff, holiday_ordinals):
+    """Walks forward from the day after order_day, counting Mon-Sat non-holidays."""
+    working_days_to_add = _working_days_to_add(order_day, after_cutoff)
     
-    # 3. Count forward the required number of WORKING days
+    # Start from tomorrow and count forward the required number of WORKING days
+    delivery_date = order_day + timedelta(days=1)
     working_days_counted = 0
     
-    while working_days_counted < working_days_to_add:
-        # Check if this date is a working day
-        is_working_day = True
-        
-        # Check if Sunday (weekday 6)
-        if delivery_date.weekday() == 6:
-            is_working_day = False
-        
-        # Check if Public Holiday (from database)
-        if PublicHoliday.objects.filter(date=delivery_date).exists():
-            is_working_day = False
-        
-        # If it's a working day, count it
-        if is_working_day:
+    while True:
+        # Sunday (weekday 6) and public holidays (from the in-memory index) are skipped
+        if delivery_date.weekday() != 6 and delivery_date.toordinal() not in holiday_ordinals:
             working_days_counted += 1
-            
-            # If we've counted enough working days, we're done
             if working_days_counted == working_days_to_add:
-                break
-        
-        # Move to next day
+                return delivery_date
         delivery_date += timedelta(days=1)
+
+
+# --- DELIVERY DATE TABLE ---
+# A delivery date only depends on the local order date, the cutoff bucket and
+# the holiday set, so the next few days are precomputed once per day (or per
+# holiday change) and templates/checkout just look the answer up.
+
+def get_delivery_date_table(today=None):
+    """
+    Returns {date: (before_cutoff_delivery, after_cutoff_delivery)} for
+    DELIVERY_TABLE_DAYS days starting today (local time).
+    """
+    if today is None:
+        today = timezone.localdate()
+    key = (today, holiday_version())
+    cached = _delivery_table['value']
+    if cached is not None and cached[0] == key:
+        return cached[1]
     
-    return delivery_date
+    ordinals = get_holiday_ordinals()
+    table = {}
+    for offset in range(DELIVERY_TABLE_DAYS):
+        day = today + timedelta(days=offset)
+        table[day] = (_delivery_date_for(day, False, ordinals), _delivery_date_for(day, True, ordinals))
+    _delivery_table['value'] = (key, table)
+    return table
+
+
+def get_delivery_date(order_time=None):
+    """
+    Same answer as calculate_delivery_date(), read from the precomputed table.
+    Falls back to the walk for dates outside the table (e.g. old orders).
+    """
+    order_time = timezone.localtime(order_time or timezone.now())
+    dates = get_delivery_date_table().get(order_time.date())
+    if dates is None:
+        return calculate_delivery_date(order_time)
+    return dates[order_time.hour >= DELIVERY_CUTOFF_HOUR]
+
+
+
+def bulk_delivery_dates(order_times):
+    """
+    Delivery dates for many order timestamps at once (used by backfills).
+    Builds the sorted list of working-day ordinals covering the whole span
+    once, then each order is a bisect plus an index offset instead of a
+    day-by-day walk. Results match calculate_delivery_date() exactly.
+    """
+    if not order_times:
+        return []
+    local = [timezone.localtime(t) for t in order_times]
+    ordinals = get_holiday_ordinals()
+    
+    # Working days from the day after the earliest order until two working
+    # days past the latest one (the most any order can need)
+    first = min(t.date() for t in local).toordinal() + 1
+    last = max(t.date() for t in local).toordinal()
+    working_days = []
+    day, beyond_last = first, 0
+    while beyond_last < 2:
+        if day % 7 != 0 and day not in ordinals:  # ordinal % 7 == 0 is a Sunday
+            working_days.append(day)
+            if day > last:
+                beyond_last += 1
+        day += 1
+    
+    results, memo = [], {}
+    for t in local:
+        key = (t.date(), t.hour >= DELIVERY_CUTOFF_HOUR)
+        if key not in memo:
+            order_day = key[0]
+            start = bisect_right(working_days, order_day.toordinal())
+            offset = _working_days_to_add(order_day, key[1]) - 1
+            memo[key] = datetime.date.fromordinal(working_days[start + offset])
+        results.append(memo[key])
+    return results
+
+PAGE_TOKEN_RE = re.compile(r'^([0-9]{1,9})(?:-([0-9]{1,9}))?$')
+
+
+def parse_page_ranges(page_range_string):
+    """
+    Parse a page range string into sorted, merged (start, end) intervals.
+    Same grammar as parsePageRanges() in static/js/page_ranges.js:
+    - Comma separated tokens, whitespace ignored
+    - A token is a page "N" or a range "N-M" (reversed ranges are swapped)
+    - Page numbers have at most 9 digits, so JavaScript numbers stay exact
+    - Anything else is skipped
+    
+    Runs in O(k log k) for k tokens, independent of how many pages a range covers.
+    
+    Examples:
+        parse_page_ranges("7-5, 1,3,2") → [(1, 3), (5, 7)]
+        parse_page_ranges("1-200000") → [(1, 200000)]
+    """
+    if not page_range_string:
+        return []
+    
+    intervals = []
+    for part in re.sub(r'[ \t\r\n]+', '', page_range_string).split(','):
+        match = PAGE_TOKEN_RE.fullmatch(part)
+        if not match:
+            continue
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else start
+        intervals.append((min(start, end), max(start, end)))
+    
+    intervals.sort()
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def clip_page_ranges(intervals, total_pages):
+    """Restrict merged intervals to pages 1..total_pages."""
+    clipped = []
+    for start, end in intervals:
+        start, end = max(start, 1), min(end, total_pages)
+        if start <= end:
+            clipped.append((start, end))
+    return clipped
+
+
+def format_page_ranges(intervals):
+    """Canonical string for merged intervals, e.g. [(1, 3), (5, 5)] → "1-3,5"."""
+    return ','.join(str(s) if s == e else f"{s}-{e}" for s, e in intervals)
+
+
+def canonical_page_ranges(page_range_string, total_pages=None):
+    """
+    Canonical form of a page range string, cheap to store and compare.
+    canonical_page_ranges(" 5-7,1, 3, 6") → "1,3,5-7"
+    """
+    intervals = parse_page_ranges(page_range_string)
+    if total_pages is not None:
+        intervals = clip_page_ranges(intervals, total_pages)
+    return format_page_ranges(intervals)
 
 
 def count_color_pages(page_range_string, total_pages):
@@ -90,39 +222,10 @@ def count_color_pages(page_range_string, total_pages):
         count_color_pages("1-10,15", 20) → 11 pages
         count_color_pages("", 10) → 0 pages
     """
-    if not page_range_string:
-        return 0
-    
-    color_pages_set = set()
-    parts = page_range_string.replace(' ', '').split(',')
-    
-    for part in parts:
-        if not part:  # Skip empty parts
-            continue
-            
-        if '-' in part:
-            # Handle range like "5-7"
-            try:
-                start, end = part.split('-')
-                for i in range(int(start), int(end) + 1):
-                    if 1 <= i <= total_pages:
-                        color_pages_set.add(i)
-            except (ValueError, IndexError):
-                # Skip invalid ranges
-                continue
-        else:
-            # Handle single page like "3"
-            try:
-                page = int(part)
-                if 1 <= page <= total_pages:
-                    color_pages_set.add(page)
-            except ValueError:
-                # Skip invalid page numbers
-                continue
-    
-    return len(color_pages_set)
+    intervals = clip_page_ranges(parse_page_ranges(page_range_string), total_pages)
+    return sum(end - start + 1 for start, end in intervals)
+
 
-
 from django.core.mail import send_mail
 from django.conf import settings
 from django.db.models import Q
@@ -0,0 +1,39 @@
+"""
+Cross-worker version tokens.
+
+A token lives in the shared cache (settings.CACHES: Redis or the database
+table), so a bump made by one gunicorn worker reaches all of them. Each
+process re-reads a token at most every VERSION_CHECK_INTERVAL seconds, which
+keeps hot paths (pricing every order on a dashboard) off the cache backend.
+A token that was evicted is re-minted, which only costs a rebuild.
+"""
+import time
+import uuid
+
+from django.core.cache import cache
+
+VERSION_CHECK_INTERVAL = 1.0  # seconds
+
+_seen = {}  # key -> (token, time.monotonic() when read)
+
+
+def get_version(key):
+    """Current token for key, minting one if the cache has none."""
+    now = time.monotonic()
+    seen = _seen.get(key)
+    if seen is not None and now - seen[1] < VERSION_CHECK_INTERVAL:
+        return seen[0]
+    token = cache.get(key)
+    if token is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        token = cache.get(key)
+    _seen[key] = (token, now)
+    return token
+
+
+def bump_version(key):
+    """Replaces the token; this process sees it at once, the others within VERSION_CHECK_INTERVAL."""
+    token = uuid.uuid4().hex
+    cache.set(key, token, None)
+    _seen[key] = (token, time.monotonic())
+    return token
@@ -80,6 +80,25 @@ DATABASES = {
     }
 }
 
+# 5b. CACHE
+# Must be shared by every worker: pricing/holiday version tokens, quotes and checkout
+# totals live here. Redis when REDIS_URL is set, otherwise a table in the main database.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'core_cache',
+            'OPTIONS': {'MAX_ENTRIES': 20000},
+        }
+    }
+
 # 6. PASSWORD VALIDATION
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -126,4 +145,30 @@ ADMIN_EMAIL = os.getenv('ADMIN_EMAIL', 'fastcopyteam@gmail.com')
 SUPPORT_EMAIL = os.getenv('SUPPORT_EMAIL', 'fastcopy003@gmail.com')
 SUPPORT_PHONE = os.getenv('SUPPORT_PHONE', '+91 8500290959')
 COMPANY_NAME = 'FastCopy'
-COMPANY_WEBSITE = os.getenv('COMPANY_WEBSITE', 'http://localhost:8000')
\ No newline at end of file
+COMPANY_WEBSITE = os.getenv('COMPANY_WEBSITE', 'http://localhost:8000')
+
+# 13. UPLOAD LIMITS
+# Documents are streamed to storage in chunks (core/uploads.py); anything larger is rejected mid-stream.
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', 250 * 1024 * 1024))  # bytes
+# temp/ files older than this that no cart item references are removed by clean_temp_uploads
+TEMP_UPLOAD_MAX_AGE = int(os.getenv('TEMP_UPLOAD_MAX_AGE', 2 * 24 * 60 * 60))  # seconds
+
+# 14. PDF ANALYSIS (core/analysis.py)
+# Page counting runs in a separate process pool so a hostile PDF cannot pin a web worker.
+PDF_ANALYSIS_WORKERS = int(os.getenv('PDF_ANALYSIS_WORKERS', 2))
+PDF_ANALYSIS_TIMEOUT = int(os.getenv('PDF_ANALYSIS_TIMEOUT', 15))  # seconds per job
+PDF_ANALYSIS_MEMORY_LIMIT = int(os.getenv('PDF_ANALYSIS_MEMORY_LIMIT', 1024 * 1024 * 1024))  # bytes of address space per worker
+PDF_ANALYSIS_MAX_TASKS_PER_WORKER = int(os.getenv('PDF_ANALYSIS_MAX_TASKS_PER_WORKER', 50))
+PDF_ANALYSIS_QUEUE_WAIT = int(os.getenv('PDF_ANALYSIS_QUEUE_WAIT', 10))  # seconds a request waits for a free worker
+
+# 15. THUMBNAILS (core/thumbnails.py)
+# Rendered WebP previews, keyed by source SHA-256. Safe to delete; they are re-rendered on demand.
+THUMBNAIL_CACHE_DIR = os.getenv('THUMBNAIL_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'thumbnails'))
+# Preview URLs expire, so one copied out of a page does not stay a public link to a customer's file.
+THUMBNAIL_TOKEN_MAX_AGE = int(os.getenv('THUMBNAIL_TOKEN_MAX_AGE', 6 * 60 * 60))  # seconds
+
+# 16. DOWNLOADS (core/downloads.py)
+# '' streams from Django; 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache/lighttpd) hands the transfer to the proxy.
+# nginx example:  location /protected-media/ { internal; alias /srv/fastcopy/media/; }
+DOWNLOAD_OFFLOAD = os.getenv('DOWNLOAD_OFFLOAD', '').lower()
+DOWNLOAD_ACCEL_PREFIX = os.getenv('DOWNLOAD_ACCEL_PREFIX', '/protected-media/')
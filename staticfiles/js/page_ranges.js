@@ -0,0 +1,74 @@
+/**
+ * FastCopy page range grammar (browser side).
+ * Mirrors core/utils.py parse_page_ranges() so the price estimate on the
+ * services page and the server quote always agree on the colour-page count.
+ *
+ *  - Comma separated tokens, whitespace ignored
+ *  - A token is a page "N" or a range "N-M" (reversed ranges are swapped)
+ *  - Page numbers have at most 9 digits, so JavaScript numbers stay exact
+ *  - Anything else is skipped
+ *
+ * Ranges are kept as merged [start, end] intervals, so "1-200000" costs one
+ * interval instead of 200000 Set entries.
+ */
+(function (root) {
+    const TOKEN_RE = /^([0-9]{1,9})(?:-([0-9]{1,9}))?$/;
+
+    function parsePageRanges(input) {
+        if (!input) return [];
+        const intervals = [];
+        String(input).replace(/[ \t\r\n]+/g, '').split(',').forEach(function (part) {
+            const m = TOKEN_RE.exec(part);
+            if (!m) return;
+            const a = parseInt(m[1], 10);
+            const b = m[2] !== undefined ? parseInt(m[2], 10) : a;
+            intervals.push([Math.min(a, b), Math.max(a, b)]);
+        });
+        intervals.sort(function (x, y) { return x[0] - y[0] || x[1] - y[1]; });
+
+        const merged = [];
+        intervals.forEach(function (iv) {
+            const last = merged[merged.length - 1];
+            if (last && iv[0] <= last[1] + 1) {
+                if (iv[1] > last[1]) last[1] = iv[1];
+            } else {
+                merged.push([iv[0], iv[1]]);
+            }
+        });
+        return merged;
+    }
+
+    function clipPageRanges(intervals, totalPages) {
+        const clipped = [];
+        intervals.forEach(function (iv) {
+            const start = Math.max(iv[0], 1), end = Math.min(iv[1], totalPages);
+            if (start <= end) clipped.push([start, end]);
+        });
+        return clipped;
+    }
+
+    function formatPageRanges(intervals) {
+        return intervals.map(function (iv) {
+            return iv[0] === iv[1] ? String(iv[0]) : iv[0] + '-' + iv[1];
+        }).join(',');
+    }
+
+    function countPages(intervals) {
+        return intervals.reduce(function (n, iv) { return n + iv[1] - iv[0] + 1; }, 0);
+    }
+
+    function highestPage(intervals) {
+        return intervals.length ? intervals[intervals.length - 1][1] : 0;
+    }
+
+    const api = {
+        parsePageRanges: parsePageRanges,
+        clipPageRanges: clipPageRanges,
+        formatPageRanges: formatPageRanges,
+        countPages: countPages,
+        highestPage: highestPage
+    };
+
+    if (typeof module !== 'undefined' && module.exports) module.exports = api;
+    else root.PageRanges = api;
+})(this);